@@ -1,54 +1,486 @@
 import nbformat
 from nbformat.v4 import new_notebook, new_markdown_cell
-from difflib import unified_diff
+from difflib import unified_diff, SequenceMatcher
 from datetime import datetime  # Add import for datetime
 import os  # Add import for os
+import hashlib
+import json
+import re
+import sys
+import time
+import sqlite3
+import glob
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+# Start of each cell's "outputs" array in the raw notebook JSON. A key can only
+# appear unescaped outside of string values, so this never matches cell source.
+OUTPUTS_KEY = re.compile(r'"outputs"\s*:\s*\[')
+JSON_DECODER = json.JSONDecoder()
+
+# Persistent cache of cell fingerprints and rendered cell diffs
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                         'notebook_diffs')
+CACHE_PATH = os.path.join(CACHE_DIR, 'cell_diffs.sqlite')
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_VERSION = 1
+
+CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT PRIMARY KEY,
+    stamp TEXT NOT NULL,
+    cells TEXT NOT NULL,
+    used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS diffs (
+    key TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    used REAL NOT NULL
+);
+'''
 
 # Function to compare cells
 def compare_cells(cell1, cell2):
     diff = list(unified_diff(cell1.splitlines(), cell2.splitlines(), lineterm=''))
     return '\n'.join(diff)
 
-def compare_notebooks(file1, file2):
-    # Load the two notebooks
-    with open(file1) as f:
-        nb1 = nbformat.read(f, as_version=4)
+# Render outputs as text so they can be fingerprinted and diffed like source
+def render_outputs(outputs):
+    lines = []
+    for output in outputs:
+        if output.get('output_type') == 'stream':
+            lines.append(''.join(output.get('text', '')))
+        elif output.get('output_type') == 'error':
+            lines.append(f"{output.get('ename')}: {output.get('evalue')}")
+        else:
+            for mime, value in sorted(output.get('data', {}).items()):
+                value = ''.join(value) if isinstance(value, list) else str(value)
+                if mime == 'text/plain':
+                    lines.append(value)
+                else:
+                    lines.append(f"[{mime}: {hashlib.sha1(value.encode('utf-8')).hexdigest()[:12]}]")
+    return '\n'.join(lines)
+
+# Text of a cell as it is compared: its source, plus its outputs when they were loaded
+def cell_text(cell):
+    if cell.get('outputs'):
+        return f"{cell['source']}\n# Outputs:\n{render_outputs(cell['outputs'])}"
+    return cell['source']
+
+# Fingerprint of a cell: equal fingerprints mean equal type and text
+def cell_fingerprint(cell):
+    return hashlib.sha1(f"{cell['cell_type']}\0{cell_text(cell)}".encode('utf-8')).hexdigest()
+
+def align_fingerprints(fps1, fps2):
+    """Align two lists of cell fingerprints.
+
+    Returns (op, i, j) tuples: 'equal', 'edited', 'moved', 'inserted' (i is
+    None) or 'deleted' (j is None). Cells are matched on the longest common
+    runs of identical fingerprints, so inserting a cell only reports that
+    cell. Unmatched cells inside one replaced block are paired in order as
+    edits; a deleted cell whose fingerprint is inserted elsewhere is a move.
+    """
+    alignment = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, fps1, fps2, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            alignment.extend(('equal', i, j) for i, j in zip(range(i1, i2), range(j1, j2)))
+            continue
+        paired = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+        alignment.extend(('edited', i1 + k, j1 + k) for k in range(paired))
+        alignment.extend(('deleted', i, None) for i in range(i1 + paired, i2))
+        alignment.extend(('inserted', None, j) for j in range(j1 + paired, j2))
+
+    # A cell deleted in one place and inserted unchanged in another was moved
+    inserted = {}
+    for k, (op, i, j) in enumerate(alignment):
+        if op == 'inserted':
+            inserted.setdefault(fps2[j], []).append(k)
+    moved_to = set()
+    for k, (op, i, j) in enumerate(alignment):
+        if op == 'deleted' and inserted.get(fps1[i]):
+            target = inserted[fps1[i]].pop(0)
+            alignment[k] = ('moved', i, alignment[target][2])
+            moved_to.add(target)
+    return [entry for k, entry in enumerate(alignment) if k not in moved_to]
+
+def align_cells(cells1, cells2):
+    return align_fingerprints([cell_fingerprint(cell) for cell in cells1],
+                              [cell_fingerprint(cell) for cell in cells2])
+
+def strip_outputs(text):
+    """Replace every "outputs" array of the raw notebook JSON with [].
+
+    The whole file is still read into a string, and the C JSON decoder fully
+    decodes each outputs array to find where it ends; the decoded array is
+    dropped right away. What this saves is building nbformat objects (and
+    validating them) for outputs the report never shows.
+    """
+    parts = []
+    pos = 0
+    for match in OUTPUTS_KEY.finditer(text):
+        if match.start() < pos:
+            continue  # an "outputs" key nested inside an array already skipped
+        start = match.end() - 1
+        parts.append(text[pos:start])
+        parts.append('[]')
+        pos = JSON_DECODER.raw_decode(text, start)[1]
+    parts.append(text[pos:])
+    return ''.join(parts)
 
-    with open(file2) as f:
-        nb2 = nbformat.read(f, as_version=4)
+def load_cells(text, include_outputs=False):
+    """Parse notebook JSON into plain cell dicts (cell_type, source, outputs).
 
-    # Compare the notebooks cell by cell
+    Skips nbformat's full read and schema validation. Old (v3) notebooks are
+    still read through nbformat so that they get upgraded to the v4 layout.
+    """
+    notebook = json.loads(text if include_outputs else strip_outputs(text))
+    if notebook.get('nbformat', 4) < 4:
+        notebook = nbformat.reads(text, as_version=4)
+    cells = []
+    for cell in notebook.get('cells', []):
+        source = cell.get('source', '')
+        cells.append({
+            'cell_type': cell.get('cell_type', ''),
+            'source': ''.join(source) if isinstance(source, list) else source,
+            'outputs': cell.get('outputs', []) if include_outputs else [],
+        })
+    return cells
+
+# Read one side of a pair: a file path, or (revision, path, blob id) from git. None is an absent file.
+def read_notebook_text(source):
+    if source is None:
+        return None
+    if isinstance(source, tuple):
+        return subprocess.run(['git', 'cat-file', 'blob', source[2]], capture_output=True,
+                              check=True).stdout.decode('utf-8')
+    with open(source, encoding='utf-8') as f:
+        return f.read()
+
+# Body of one report entry: the inserted or deleted cell's text, or the diff of an edited pair
+def render_body(cells1, cells2, i, j):
+    if i is None:
+        return cell_text(cells2[j])
+    if j is None:
+        return cell_text(cells1[i])
+    return compare_cells(cell_text(cells1[i]), cell_text(cells2[j]))
+
+def describe_alignment(entries1, entries2, body):
+    """Describe every non-equal cell as one report entry.
+
+    entries are (cell_type, fingerprint) lists; body(i, j) returns the text
+    of an inserted (i is None), deleted (j is None) or edited cell.
+    """
     differences = []
-    for i, (cell1, cell2) in enumerate(zip(nb1.cells, nb2.cells)):
-        if cell1['cell_type'] == cell2['cell_type']:
-            if cell1['source'] != cell2['source']:
-                diff = compare_cells(cell1['source'], cell2['source'])
-                differences.append(f"Cell {i} differences:\n{diff}\n")
+    for op, i, j in align_fingerprints([fp for _, fp in entries1], [fp for _, fp in entries2]):
+        if op == 'equal':
+            continue
+        if op == 'inserted':
+            differences.append(f"Cell {j} inserted ({entries2[j][0]}):\n{body(None, j)}\n")
+        elif op == 'deleted':
+            differences.append(f"Cell {i} deleted ({entries1[i][0]}):\n{body(i, None)}\n")
+        elif op == 'moved':
+            differences.append(f"Cell {i} moved to position {j} (unchanged)\n")
+        elif entries1[i][0] != entries2[j][0]:
+            differences.append(f"Cell {i} -> {j} type mismatch: {entries1[i][0]} != {entries2[j][0]}\n")
         else:
-            differences.append(f"Cell {i} type mismatch: {cell1['cell_type']} != {cell2['cell_type']}\n")
+            differences.append(f"Cell {i} -> {j} differences:\n{body(i, j)}\n")
+    return differences
+
+def diff_cells(cells1, cells2):
+    entries1, entries2 = ([(cell['cell_type'], cell_fingerprint(cell)) for cell in cells] for cells in (cells1, cells2))
+    return describe_alignment(entries1, entries2, lambda i, j: render_body(cells1, cells2, i, j))
+
+class NotebookDiffCache:
+    """SQLite cache of cell fingerprints per notebook and of rendered cell diffs.
+
+    files maps a notebook (its path plus mtime and size, or its git blob id)
+    to its (cell_type, fingerprint) list, so an unchanged notebook costs one
+    stat and is not read. diffs maps a fingerprint pair to the rendered diff,
+    so unchanged cells cost no diff work. Pool workers only read the cache;
+    the parent process writes their new rows in one transaction and then
+    evicts least-recently-used rows until the cache fits in max_bytes.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(CACHE_SCHEMA)
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != str(CACHE_VERSION):
+            with self.connection:
+                self.connection.execute('DELETE FROM files')
+                self.connection.execute('DELETE FROM diffs')
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(CACHE_VERSION),))
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, updates):
+        """Write the new rows and hits reported by diff_pair, then evict."""
+        now = time.time()
+        with self.connection:
+            for new_files, new_diffs, file_hits, diff_hits in updates:
+                self.connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                            [(key, stamp, cells, now) for key, (stamp, cells) in new_files.items()])
+                self.connection.executemany('INSERT OR REPLACE INTO diffs VALUES (?, ?, ?)',
+                                            [(key, body, now) for key, body in new_diffs.items()])
+                self.connection.executemany('UPDATE files SET used = ? WHERE key = ?', [(now, key) for key in file_hits])
+                self.connection.executemany('UPDATE diffs SET used = ? WHERE key = ?', [(now, key) for key in diff_hits])
+        self.evict()
+
+    def evict(self):
+        """Delete least-recently-used rows until the cache fits in max_bytes."""
+        total = self.connection.execute('SELECT (SELECT coalesce(sum(length(cells)), 0) FROM files) + '
+                                        '(SELECT coalesce(sum(length(body)), 0) FROM diffs)').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute('SELECT used, length(cells), key, 0 FROM files UNION ALL '
+                                       'SELECT used, length(body), key, 1 FROM diffs ORDER BY used').fetchall()
+        stale = ([], [])
+        for _, size, key, table in rows:
+            if total <= self.max_bytes:
+                break
+            stale[table].append((key,))
+            total -= size
+        with self.connection:
+            self.connection.executemany('DELETE FROM files WHERE key = ?', stale[0])
+            self.connection.executemany('DELETE FROM diffs WHERE key = ?', stale[1])
+
+# Key and stamp of a notebook in the files table: a git blob id never changes, a path is checked by one stat
+def file_cache_key(source, include_outputs):
+    if source is None:
+        return None, None
+    if isinstance(source, tuple):
+        return f"{int(include_outputs)}:git:{source[2]}", ''
+    st = os.stat(source)
+    return f"{int(include_outputs)}:{os.path.abspath(source)}", f"{st.st_mtime_ns}:{st.st_size}"
 
+def open_cache_reader(cache_path):
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    try:
+        return sqlite3.connect(f'file:{cache_path}?mode=ro', uri=True)
+    except sqlite3.Error:
+        return None
+
+def diff_cached_pair(source1, source2, include_outputs, db, record):
+    """Diff one pair, reading fingerprints and rendered diffs from db where possible.
+
+    Returns the report entries and the cache updates: (new file rows, new diff
+    rows, file keys hit, diff keys hit). Notebook text is only loaded for a
+    notebook missing from the files table, or when a diff must be rendered.
+    """
+    new_files, new_diffs, file_hits, diff_hits = {}, {}, [], []
+    sources = (source1, source2)
+    cells = [None, None]
+    entries = [[], []]
+    for side, source in enumerate(sources):
+        if source is None:
+            cells[side] = []
+            continue
+        key, stamp = file_cache_key(source, include_outputs)
+        row = db.execute('SELECT cells FROM files WHERE key = ? AND stamp = ?', (key, stamp)).fetchone() if db else None
+        if row:
+            entries[side] = json.loads(row[0])
+            file_hits.append(key)
+            continue
+        cells[side] = load_cells(read_notebook_text(source), include_outputs)
+        entries[side] = [(cell['cell_type'], cell_fingerprint(cell)) for cell in cells[side]]
+        if record:
+            new_files[key] = (stamp, json.dumps(entries[side]))
+
+    def body(i, j):
+        key = f"{entries[0][i][1] if i is not None else ''}:{entries[1][j][1] if j is not None else ''}"
+        row = db.execute('SELECT body FROM diffs WHERE key = ?', (key,)).fetchone() if db else None
+        if row:
+            diff_hits.append(key)
+            return row[0]
+        for side, index in enumerate((i, j)):
+            if index is not None and cells[side] is None:
+                cells[side] = load_cells(read_notebook_text(sources[side]), include_outputs)
+        text = render_body(cells[0], cells[1], i, j)
+        if record:
+            new_diffs[key] = text
+        return text
+
+    differences = describe_alignment(entries[0], entries[1], body)
+    return differences, (new_files, new_diffs, file_hits, diff_hits)
+
+# Worker for the process pool: diff one pair, reporting failures instead of raising
+def diff_pair(task):
+    source1, source2, include_outputs, cache_path, record = task
+    db = open_cache_reader(cache_path)
+    try:
+        return diff_cached_pair(source1, source2, include_outputs, db, record)
+    except (OSError, ValueError, sqlite3.Error, subprocess.CalledProcessError) as e:
+        detail = e.stderr.decode('utf-8', 'replace').strip() if isinstance(e, subprocess.CalledProcessError) else e
+        return [f"Error: Could not read notebooks: {detail}\n"], ({}, {}, [], [])
+    finally:
+        if db is not None:
+            db.close()
+
+def describe_source(source):
+    if source is None:
+        return '(absent)'
+    if isinstance(source, tuple):
+        return f"{source[0]}:{source[1]}"
+    return source
+
+def write_report(sections, output_filename=None):
     # Create a new notebook with the differences
     new_nb = new_notebook()
     new_nb.cells.append(new_markdown_cell("# Differences between Notebooks"))
 
-    if differences:
-        for diff in differences:
-            new_nb.cells.append(new_markdown_cell(diff))
-    else:
-        new_nb.cells.append(new_markdown_cell("No differences found."))
+    for title, differences in sections:
+        if title:
+            new_nb.cells.append(new_markdown_cell(f"## {title}\n\n{len(differences)} difference(s)"))
+        if differences:
+            for diff in differences:
+                new_nb.cells.append(new_markdown_cell(diff))
+        else:
+            new_nb.cells.append(new_markdown_cell("No differences found."))
 
     # Save the new notebook with datetime stamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M")  # Generate timestamp
-    output_filename = f'Notebook_Diffs_REPORTER_OUTPUT_{timestamp}.ipynb'  # Create filename with timestamp
+    if output_filename is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M")  # Generate timestamp
+        output_filename = f'Notebook_Diffs_REPORTER_OUTPUT_{timestamp}.ipynb'  # Create filename with timestamp
     with open(output_filename, 'w') as f:
         nbformat.write(new_nb, f)
-    
+
     # Output success message
     output_path = os.path.abspath(output_filename)
     print(f"Comparison successful!\nOutput file: {output_filename}\nLocation: {output_path}")
+    return output_filename
 
-if __name__ == "__main__":
-    file1 = 'Compare Conda Virtual Environments Visually_v2024.12.28 copy.ipynb'
-    file2 = 'Compare Conda Virtual Environments Visually_v2024.12.28.ipynb'
-    compare_notebooks(file1, file2)
+def run_pairs(pairs, include_outputs=False, jobs=None, cache=None, refresh=False):
+    """Diff notebook pairs (on a process pool when there are several) and return their report entries."""
+    cache_path = cache.path if cache is not None and not refresh else None
+    tasks = [(source1, source2, include_outputs, cache_path, cache is not None) for source1, source2 in pairs]
+    if len(tasks) > 1 and jobs != 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(tasks) // (4 * (jobs or os.cpu_count() or 1)))
+            results = list(executor.map(diff_pair, tasks, chunksize=chunksize))
+    else:
+        results = [diff_pair(task) for task in tasks]
+    if cache is not None:
+        try:
+            cache.update([updates for _, updates in results])
+        except sqlite3.Error as e:
+            print(f"Warning: Could not update the notebook diff cache: {str(e)}")
+    return [differences for differences, _ in results]
 
+def compare_notebooks(file1, file2, include_outputs=False, output_filename=None, cache=None, refresh=False):
+    # Load the two notebooks without their outputs, then diff the aligned cells
+    differences = run_pairs([(file1, file2)], include_outputs, cache=cache, refresh=refresh)[0]
+    return write_report([(None, differences)], output_filename)
+
+def batch_compare(pairs, include_outputs=False, output_filename=None, jobs=None, cache=None, refresh=False):
+    """Diff many notebook pairs on a process pool and write one combined report."""
+    results = run_pairs(pairs, include_outputs, jobs, cache, refresh)
+    sections = [(f"{describe_source(source1)} vs {describe_source(source2)}", differences)
+                for (source1, source2), differences in zip(pairs, results)]
+    changed = sum(1 for _, differences in sections if differences)
+    print(f"{len(sections)} notebook pair(s) compared, {changed} with differences.")
+    return write_report(sections, output_filename)
+
+# Successive versions: each glob match is paired with the next one in sorted order
+def pairs_from_glob(pattern):
+    files = sorted(glob.glob(pattern))
+    return list(zip(files, files[1:]))
+
+# One pair per line, the two paths separated by a tab (paths may contain spaces)
+def pairs_from_file(filename):
+    pairs = []
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            parts = line.split('\t')
+            if len(parts) != 2:
+                print(f"Warning: Skipping line without exactly one tab: {line!r}")
+                continue
+            pairs.append((parts[0], parts[1]))
+    return pairs
+
+def pairs_from_git(revision_range):
+    """Notebooks changed in a git revision range ("A..B", or "A" for A vs the working tree)."""
+    old, _, new = revision_range.partition('..')
+    output = subprocess.run(['git', 'diff', '--relative', '--raw', '--no-abbrev', '-z', old] + ([new] if new else []) +
+                            ['--', '*.ipynb'], capture_output=True, check=True).stdout.decode('utf-8')
+    fields = output.split('\0')[:-1]
+    pairs = []
+    i = 0
+    while i < len(fields):
+        # ":<mode> <mode> <blob> <blob> <status>", then one path (two for renames and copies)
+        _, _, blob1, blob2, status = fields[i].split(' ')
+        status = status[0]
+        if status in 'RC':
+            path1, path2 = fields[i + 1], fields[i + 2]
+            i += 3
+        else:
+            path1 = path2 = fields[i + 1]
+            i += 2
+        source1 = None if status == 'A' else (old, path1, blob1)
+        source2 = None if status == 'D' else ((new, path2, blob2) if new else path2)
+        pairs.append((source1, source2))
+    return pairs
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the cell differences between Jupyter notebooks.")
+    parser.add_argument('notebooks', nargs='*', help="two notebooks to compare")
+    parser.add_argument('--glob', help="compare each notebook matching this pattern with the next one (sorted)")
+    parser.add_argument('--pairs', help="file with one tab-separated notebook pair per line")
+    parser.add_argument('--git', metavar='REV_RANGE',
+                        help="compare the notebooks changed in a git revision range (A..B, or A for A vs the working tree)")
+    parser.add_argument('--include-outputs', action='store_true', help="also compare cell outputs (slower)")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('-o', '--output', help="report file name (default: timestamped)")
+    parser.add_argument('--no-cache', action='store_true', help=f"do not use the cell diff cache in {CACHE_PATH}")
+    parser.add_argument('--refresh', action='store_true', help="ignore cached entries (they are rewritten)")
+    args = parser.parse_args()
+
+    if args.notebooks and len(args.notebooks) != 2:
+        parser.error("give exactly two notebooks, or use --glob, --pairs or --git")
+    pairs = [tuple(args.notebooks)] if args.notebooks else []
+    try:
+        if args.glob:
+            pairs += pairs_from_glob(args.glob)
+        if args.pairs:
+            pairs += pairs_from_file(args.pairs)
+        if args.git:
+            pairs += pairs_from_git(args.git)
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = e.stderr.decode('utf-8', 'replace').strip() if isinstance(e, subprocess.CalledProcessError) else e
+        print(f"Error: Could not list notebook pairs: {detail}")
+        sys.exit(1)
+
+    cache = None
+    if not args.no_cache:
+        try:
+            cache = NotebookDiffCache()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: Could not open the notebook diff cache {CACHE_PATH}: {str(e)}")
+
+    if not args.notebooks and not (args.glob or args.pairs or args.git):
+        # Original behaviour: the two notebooks this script was written for
+        file1 = 'Compare Conda Virtual Environments Visually_v2024.12.28 copy.ipynb'
+        file2 = 'Compare Conda Virtual Environments Visually_v2024.12.28.ipynb'
+        compare_notebooks(file1, file2, args.include_outputs, args.output, cache, args.refresh)
+    elif not pairs:
+        print("Warning: No notebook pairs to compare.")
+    elif args.notebooks and len(pairs) == 1:
+        compare_notebooks(*pairs[0], args.include_outputs, args.output, cache, args.refresh)
+    else:
+        batch_compare(pairs, args.include_outputs, args.output, args.jobs, cache, args.refresh)
+    if cache is not None:
+        cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+"""
+File: conda_compare_benchmark.py
+
+Offline benchmark of the conda_compare_envs_final.py pipeline.
+
+Generates pairs of synthetic environment prefixes (conda-meta/*.json
+records, conda-meta/history, pip *.dist-info folders) plus the matching
+fake `conda list` / `conda list --revisions` output at several scales, then
+times every stage of a comparison on them:
+
+- collect:        native snapshot of both prefixes (no cache)
+- collect_cached: the same with a warm snapshot cache
+- collect_conda:  the `conda list` fallback, served by a fake conda executable
+- parse:          parsing the `conda list` text alone
+- merge:          compare_environments + split_comparison
+- style:          class-based styling of the three tables (conda_compare_styling),
+                  built and rendered to HTML as the notebook displays them
+- render:         text report and HTML report payload, in memory
+- write:          .txt, .html and .jsonl report files
+
+No conda installation or network access is needed. Every scale runs in a
+fresh interpreter so its peak RSS is not inflated by the previous one.
+Results are written as JSON; pass an earlier result file with --baseline to
+print the ratio of every stage against it.
+
+Usage:
+    python conda_compare_benchmark.py                       # 50 / 500 / 5,000 / 50,000 packages
+    python conda_compare_benchmark.py --sizes 50 500 --repeat 5
+    python conda_compare_benchmark.py --output bench.json --baseline bench_main.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+
+from conda_compare_core import collect_snapshots, get_peak_rss_mb, parse_conda_list, SnapshotCache
+
+BENCHMARK_SCHEMA_VERSION = 1
+DEFAULT_SIZES = (50, 500, 5000, 50000)
+DEFAULT_REPEAT = 3
+STAGES = ('collect', 'collect_cached', 'collect_conda', 'parse', 'merge', 'style', 'render', 'write')
+
+# Shape of the synthetic environment pairs
+CHANGED_FRACTION = 0.10   # packages whose version/build differ in the second environment
+REMOVED_FRACTION = 0.05   # packages only in the first environment
+ADDED_FRACTION = 0.05     # packages only in the second environment
+PIP_FRACTION = 0.05       # packages installed with pip (*.dist-info) instead of conda
+PACKAGES_PER_REVISION = 50
+CHANNELS = {
+    'defaults': 'https://repo.anaconda.com/pkgs/main/linux-64',
+    'conda-forge': 'https://conda.anaconda.org/conda-forge/noarch',
+}
+
+FAKE_CONDA = '''#!{python}
+# Fake conda executable written by conda_compare_benchmark.py: serves canned
+# `conda list` / `conda list --revisions` output for the benchmark environments.
+import os, sys
+args = sys.argv[1:]
+name = os.path.basename(args[args.index('-n' if '-n' in args else '-p') + 1])
+suffix = '.revisions.txt' if '--revisions' in args else '.list.txt'
+with open(os.path.join({listing_dir!r}, name + suffix)) as f:
+    sys.stdout.write(f.read())
+'''
+
+def make_packages(size, rng):
+    """Return a sorted {name: record} dict of size synthetic packages."""
+    pkgs = {}
+    for i in range(size):
+        name = f'pkg-{i:05d}'
+        channel = 'conda-forge' if rng.random() < 0.6 else 'defaults'
+        version = f'{rng.randint(0, 5)}.{rng.randint(0, 30)}.{rng.randint(0, 20)}'
+        build = f'py311h{rng.getrandbits(24):06x}_{rng.randint(0, 3)}'
+        pkgs[name] = {'version': version, 'build': build, 'channel': channel,
+                      'pip': rng.random() < PIP_FRACTION}
+    return pkgs
+
+def mutate_packages(pkgs, rng):
+    """Derive a second environment: some packages upgraded, removed and added."""
+    other = {}
+    for name, info in pkgs.items():
+        roll = rng.random()
+        if roll < REMOVED_FRACTION:
+            continue
+        info = dict(info)
+        if roll < REMOVED_FRACTION + CHANGED_FRACTION:
+            major, minor, patch = info['version'].split('.')
+            info['version'] = f'{major}.{int(minor) + 1}.{patch}'
+            info['build'] = f'py311h{rng.getrandbits(24):06x}_0'
+        other[name] = info
+    for i in range(int(len(pkgs) * ADDED_FRACTION)):
+        other[f'extra-{i:05d}'] = {'version': f'1.{i % 10}.0', 'build': 'pyhd8ed1ab_0',
+                                   'channel': 'conda-forge', 'pip': False}
+    return other
+
+def write_prefix(prefix, pkgs, rng):
+    """Write conda-meta records, history and pip dist-info folders for pkgs."""
+    meta_dir = os.path.join(prefix, 'conda-meta')
+    site_dir = os.path.join(prefix, 'lib', 'python3.11', 'site-packages')
+    os.makedirs(meta_dir)
+    os.makedirs(site_dir)
+    conda_pkgs = []
+    for name, info in pkgs.items():
+        if info['pip']:
+            dist_info = os.path.join(site_dir, f"{name.replace('-', '_')}-{info['version']}.dist-info")
+            os.mkdir(dist_info)
+            with open(os.path.join(dist_info, 'INSTALLER'), 'w') as f:
+                f.write('pip\n')
+            continue
+        conda_pkgs.append(name)
+        files = [f'lib/python3.11/site-packages/{name}/module_{j}.py' for j in range(8)]
+        record = {
+            'name': name, 'version': info['version'], 'build': info['build'],
+            'build_number': int(info['build'].rsplit('_', 1)[1]),
+            'channel': CHANNELS[info['channel']], 'subdir': CHANNELS[info['channel']].rsplit('/', 1)[1],
+            'depends': ['python >=3.11', 'libzlib'], 'files': files,
+            'paths_data': {'paths': [{'_path': path, 'path_type': 'hardlink', 'size_in_bytes': 1024}
+                                     for path in files], 'paths_version': 1},
+        }
+        with open(os.path.join(meta_dir, f"{name}-{info['version']}-{info['build']}.json"), 'w') as f:
+            json.dump(record, f, indent=2)
+
+    revisions = [conda_pkgs[i:i + PACKAGES_PER_REVISION] for i in range(0, len(conda_pkgs), PACKAGES_PER_REVISION)]
+    with open(os.path.join(meta_dir, 'history'), 'w') as f:
+        for rev, names in enumerate(revisions):
+            f.write(f'==> 2024-{1 + rev % 12:02d}-{1 + rev % 28:02d} 10:{rev % 60:02d}:00 <==\n')
+            f.write(f'# cmd: conda install {" ".join(names[:3])}\n')
+            for name in names:
+                info = pkgs[name]
+                f.write(f"+{info['channel']}::{name}-{info['version']}-{info['build']}\n")
+    return len(revisions)
+
+def write_conda_list(filename, prefix, pkgs):
+    """Write the `conda list` output conda would print for pkgs."""
+    with open(filename, 'w') as f:
+        f.write(f'# packages in environment at {prefix}:\n#\n# Name                    Version                   Build  Channel\n')
+        for name, info in pkgs.items():
+            if info['pip']:
+                f.write(f"{name:<25} {info['version']:<25} {'pypi_0':>15}  pypi\n")
+            else:
+                channel = '' if info['channel'] == 'defaults' else info['channel']
+                f.write(f"{name:<25} {info['version']:<25} {info['build']:>15}  {channel}\n")
+
+def write_conda_revisions(filename, revision_count):
+    """Write `conda list --revisions` output with revision_count revisions."""
+    with open(filename, 'w') as f:
+        for rev in range(revision_count):
+            f.write(f'2024-{1 + rev % 12:02d}-{1 + rev % 28:02d} 10:{rev % 60:02d}:00  (rev {rev})\n    +pkg\n\n')
+
+def generate_fixture(root, size, seed=0):
+    """Create two synthetic prefixes plus fake conda output under root.
+
+    Returns the two prefix paths, their names for the fake conda and the
+    path of the fake conda executable (None on Windows).
+    """
+    rng = random.Random(seed)
+    pkgs_a = make_packages(size, rng)
+    pkgs_b = mutate_packages(pkgs_a, rng)
+    listing_dir = os.path.join(root, 'listings')
+    os.makedirs(listing_dir)
+    prefixes = []
+    for label, pkgs in (('bench_a', pkgs_a), ('bench_b', pkgs_b)):
+        prefix = os.path.join(root, 'prefixes', label)
+        revision_count = write_prefix(prefix, pkgs, rng)
+        write_conda_list(os.path.join(listing_dir, f'{label}.list.txt'), prefix, pkgs)
+        write_conda_revisions(os.path.join(listing_dir, f'{label}.revisions.txt'), revision_count)
+        prefixes.append(prefix)
+
+    conda_exe = None
+    if os.name != 'nt':
+        conda_exe = os.path.join(root, 'bin', 'conda')
+        os.makedirs(os.path.dirname(conda_exe))
+        with open(conda_exe, 'w') as f:
+            f.write(FAKE_CONDA.format(python=sys.executable, listing_dir=listing_dir))
+        os.chmod(conda_exe, 0o755)
+    return prefixes, ['bench_a', 'bench_b'], conda_exe
+
+def time_stage(timings, name, repeat, func):
+    """Run func repeat times, keep the fastest wall/CPU time, and return its last result."""
+    best = None
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = func()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if best is None or wall < best[0]:
+            best = (wall, cpu)
+    timings[name] = {'wall_s': round(best[0], 6), 'cpu_s': round(best[1], 6),
+                     'peak_rss_mb': get_peak_rss_mb()}
+    return result
+
+def run_scale(size, repeat, seed=0):
+    """Generate one fixture and time every stage on it (meant to run in a fresh process)."""
+    import pandas as pd
+    from conda_compare_envs_final import (
+        compare_environments, iter_report_chunks, save_comparison_records,
+        save_comparison_to_file, split_comparison,
+    )
+    from conda_compare_html import encode_comparison, save_html_report
+    from conda_compare_styling import apply_diff_styling, apply_styling, apply_unique_styling
+
+    root = tempfile.mkdtemp(prefix=f'conda_compare_bench_{size}_')
+    try:
+        generated = time.perf_counter()
+        prefixes, conda_names, conda_exe = generate_fixture(root, size, seed=seed)
+        generated = time.perf_counter() - generated
+        timings = {}
+        cache = SnapshotCache(cache_dir=os.path.join(root, 'cache'))
+
+        snapshots = time_stage(timings, 'collect', repeat,
+                               lambda: list(collect_snapshots(prefixes).values()))
+        cache.store(snapshots[0])
+        cache.store(snapshots[1])
+        time_stage(timings, 'collect_cached', repeat,
+                   lambda: collect_snapshots(prefixes, cache=cache))
+        if conda_exe:
+            os.environ.update(CONDA_EXE=conda_exe, CONDA_ROOT=os.path.join(root, 'no_root'))
+            with redirect_stdout(StringIO()):  # the conda fallback announces every command
+                time_stage(timings, 'collect_conda', repeat,
+                           lambda: collect_snapshots(conda_names))
+        with open(os.path.join(root, 'listings', 'bench_a.list.txt')) as f:
+            listing = f.read()
+        time_stage(timings, 'parse', repeat, lambda: parse_conda_list(listing))
+
+        comparison = time_stage(timings, 'merge', repeat,
+                                lambda: compare_environments(snapshots))
+        same_vers, diff_vers, unique_pkgs = split_comparison(comparison)
+        env_names = [snapshot.name for snapshot in snapshots]
+
+        def style():
+            # Rendering is part of the stage: the notebook displays the HTML of every table
+            stylers = [apply_styling(same_vers, *env_names), apply_diff_styling(diff_vers, *env_names),
+                       apply_unique_styling(unique_pkgs, *env_names)]
+            return sum(len(styler.to_html()) for styler in stylers)
+
+        def render():
+            text = StringIO()
+            text.writelines(iter_report_chunks(snapshots, same_vers, diff_vers, unique_pkgs))
+            return text.tell() + len(json.dumps(encode_comparison(comparison, env_names)))
+
+        def write():
+            basename = os.path.join(root, 'report')
+            save_comparison_to_file(f'{basename}.txt', snapshots, same_vers, diff_vers, unique_pkgs)
+            save_html_report(f'{basename}.html', snapshots, comparison)
+            save_comparison_records(basename, 'jsonl', snapshots, comparison)
+
+        pd.set_option('display.max_columns', None)
+        pd.set_option('display.width', None)
+        time_stage(timings, 'style', repeat, style)
+        time_stage(timings, 'render', repeat, render)
+        time_stage(timings, 'write', repeat, write)
+        counts = comparison[('Package', 'Status')].value_counts()
+        return {
+            'packages': size,
+            'records': [snapshot.package_count for snapshot in snapshots],
+            'sections': {status: int(count) for status, count in counts.items()},
+            'fixture_s': round(generated, 3),
+            'stages': timings,
+            'peak_rss_mb': get_peak_rss_mb(),
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def get_commit():
+    """Return the current git commit of the benchmarked tree, or None."""
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+        return None
+    return result.stdout.decode('utf-8').strip() or None
+
+def get_versions():
+    """Versions of the libraries the measured stages depend on."""
+    versions = {'python': platform.python_version()}
+    for module in ('pandas', 'numpy', 'pyarrow'):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return versions
+
+def load_baseline(filename):
+    """Index the stage timings of an earlier result file by package count."""
+    with open(filename) as f:
+        baseline = json.load(f)
+    return {result['packages']: result['stages'] for result in baseline.get('results', [])}
+
+def print_results(results, baseline=None):
+    """Print one row per scale with the wall time of every stage (and ratio to the baseline)."""
+    header = f"{'packages':>9}" + ''.join(f'{stage:>16}' for stage in STAGES) + f"{'peak_rss_mb':>13}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        cells = []
+        for stage in STAGES:
+            timing = result['stages'].get(stage)
+            if timing is None:
+                cells.append(f"{'-':>16}")
+                continue
+            cell = f"{timing['wall_s'] * 1000:.1f}ms"
+            old = (baseline or {}).get(result['packages'], {}).get(stage)
+            if old and old['wall_s']:
+                cell += f" x{timing['wall_s'] / old['wall_s']:.2f}"
+            cells.append(f'{cell:>16}')
+        peak = result['peak_rss_mb']
+        print(f"{result['packages']:>9}" + ''.join(cells) + f"{peak if peak is not None else '-':>13}")
+
+def main():
+    """Main function to run the benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark the conda comparison pipeline on synthetic environments.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help=f"package counts to benchmark (default: {' '.join(map(str, DEFAULT_SIZES))})")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f"runs per stage, the fastest is kept (default: {DEFAULT_REPEAT})")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic environments (default: 0)")
+    parser.add_argument('--output', help="JSON result file (default: conda_compare_benchmark_<timestamp>.json)")
+    parser.add_argument('--baseline', help="earlier JSON result file to compare the stage timings against")
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    baseline = None
+    if args.baseline:
+        try:
+            baseline = load_baseline(args.baseline)
+        except (OSError, ValueError) as e:
+            parser.error(f"Could not read baseline {args.baseline}: {str(e)}")
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for size in args.sizes:
+        print(f"Benchmarking {size} packages...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results.append(pool.submit(run_scale, size, args.repeat, args.seed).result())
+
+    report = {
+        'schema_version': BENCHMARK_SCHEMA_VERSION,
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': get_commit(),
+        'platform': platform.platform(),
+        'versions': get_versions(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+    filename = args.output or f"conda_compare_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print_results(results, baseline)
+    print(f"\nFile: {filename} created.")
+    print("\nDone.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1087 @@
+"""
+File: conda_compare_core.py
+
+Lightweight core of conda_compare_envs_final.py: environment discovery,
+snapshot collection and caching, version parsing and a plain-dict package
+diff. Nothing here imports pandas or NumPy, so quick checks (--check) start
+in a few tens of milliseconds; the table renderers in
+conda_compare_envs_final.py import pandas only when they run.
+"""
+
+import subprocess
+import os
+import re
+import glob
+import json
+import shutil
+from dataclasses import dataclass, field, asdict, replace
+from functools import lru_cache, partial
+from itertools import takewhile
+import hashlib
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+# Channels that `conda list` reports with an empty channel column
+DEFAULT_CHANNELS = ('pkgs/main', 'pkgs/r', 'pkgs/msys2', 'pkgs/free', 'pkgs/pro')
+ANACONDA_HOSTS = ('repo.anaconda.com', 'conda.anaconda.org')
+SUBDIR_SUFFIX = re.compile(r'/(noarch|(linux|osx|win|emscripten|wasi|zos)-[a-z0-9_]+)$')
+
+# Limits for the concurrent collection stage
+MAX_WORKERS = 8
+CONDA_TIMEOUT = 120  # seconds per conda command
+
+# N-way comparison: compared fields and package classification
+COMPARISON_FIELDS = ('Version', 'Build', 'Channel')
+STATUS_IDENTICAL = 'identical'
+STATUS_DIVERGENT = 'divergent'
+STATUS_PARTIAL = 'partial'
+STATUSES = (STATUS_IDENTICAL, STATUS_DIVERGENT, STATUS_PARTIAL)
+
+# Exit statuses of --check
+EXIT_IDENTICAL = 0
+EXIT_DIFFERENT = 1
+EXIT_ERROR = 2
+
+# Version ordering of each environment relative to the first (reference) one
+DIRECTION_OLDER = 'older'
+DIRECTION_NEWER = 'newer'
+DIRECTION_EQUAL = 'equal'
+DIRECTION_INCOMPARABLE = 'incomparable'
+DIRECTIONS = (DIRECTION_OLDER, DIRECTION_NEWER, DIRECTION_EQUAL, DIRECTION_INCOMPARABLE)
+VERSION_TOKEN = re.compile(r'\d+|[a-z]+')
+# Rank of alphabetic version tokens: dev < any other pre-release tag < numbers < post
+VERSION_TAG_RANKS = {'dev': -1, 'post': 2}
+VERSION_FILLER = (1, 0, '')
+
+# Persistent snapshot cache
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                         'conda_compare')
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_VERSION = 1
+# Snapshot store (conda_compare_store.py); defined here so callers need not import sqlite3 up front
+STORE_PATH = os.path.join('output_reports', 'conda_snapshots.sqlite')
+STORE_PREFIX = 'store:'
+
+# conda-meta/history parsing
+HISTORY_HEADER = re.compile(rb'^==> (.+?) <==\s*$')
+HISTORY_HEAD_BYTES = 256  # first-line prefix used to detect a rewritten history file
+REVISION_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\s+\(rev \d+\)', re.MULTILINE)
+
+# Revision time-travel (env@rev12): full package states kept every N revisions
+REVISION_SPEC = re.compile(r'^(.+)@(?:rev)?(\d+)$')
+HISTORY_KEYFRAME_INTERVAL = 32
+
+def get_peak_rss_mb():
+    """Peak resident set size of this process in MiB, or None where it cannot be measured."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+class SpanRecorder:
+    """Records timed spans of the pipeline for --timings, --trace and the benchmark.
+    
+    Each span stores its wall time, the CPU time of the thread that ran it,
+    the number of conda subprocesses launched while it was open and the
+    process peak RSS at its end. Recording is always on; a run produces a
+    few dozen spans, so the overhead is negligible.
+    """
+    
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.subprocess_count = 0
+        self.lock = threading.Lock()
+    
+    def count_subprocess(self):
+        """Count one launched subprocess."""
+        with self.lock:
+            self.subprocess_count += 1
+    
+    @contextmanager
+    def span(self, name, category='stage', **args):
+        """Time the enclosed block as one span."""
+        start, cpu_start, launched = time.perf_counter(), time.thread_time(), self.subprocess_count
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.spans.append({
+                'name': name,
+                'category': category,
+                'start': start - self.origin,
+                'wall': end - start,
+                'cpu': time.thread_time() - cpu_start,
+                'subprocesses': self.subprocess_count - launched,
+                'peak_rss_mb': get_peak_rss_mb(),
+                'tid': threading.get_native_id(),
+                'args': args,
+            })
+    
+    def summary(self):
+        """Aggregate the spans by name, ordered by when each name was first entered."""
+        rows = {}
+        for span_record in self.spans:
+            row = rows.setdefault(span_record['name'], {
+                'name': span_record['name'], 'category': span_record['category'], 'first_start': span_record['start'],
+                'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'subprocesses': 0, 'peak_rss_mb': None})
+            row['first_start'] = min(row['first_start'], span_record['start'])
+            row['calls'] += 1
+            row['wall'] += span_record['wall']
+            row['cpu'] += span_record['cpu']
+            row['subprocesses'] += span_record['subprocesses']
+            if span_record['peak_rss_mb'] is not None:
+                row['peak_rss_mb'] = max(row['peak_rss_mb'] or 0, span_record['peak_rss_mb'])
+        return sorted(rows.values(), key=lambda row: row['first_start'])
+    
+    def format_summary(self):
+        """Render the summary as a fixed-width text table."""
+        rows = self.summary()
+        width = max([len('Span')] + [len(row['name']) for row in rows])
+        lines = [f"{'Span':<{width}} {'Calls':>6} {'Wall_s':>9} {'CPU_s':>9} {'Subprocesses':>12} {'Peak_RSS_MB':>11}"]
+        lines.append('-' * len(lines[0]))
+        for row in rows:
+            peak = '-' if row['peak_rss_mb'] is None else f"{row['peak_rss_mb']:.1f}"
+            lines.append(f"{row['name']:<{width}} {row['calls']:>6} {row['wall']:>9.3f} {row['cpu']:>9.3f} "
+                         f"{row['subprocesses']:>12} {peak:>11}")
+        return '\n'.join(lines)
+    
+    def write_trace(self, filename):
+        """Write the spans in Chrome trace-event format (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        events = [{
+            'name': span_record['name'],
+            'cat': span_record['category'],
+            'ph': 'X',
+            'ts': round(span_record['start'] * 1e6, 1),
+            'dur': round(span_record['wall'] * 1e6, 1),
+            'pid': pid,
+            'tid': span_record['tid'],
+            'args': dict(span_record['args'], cpu_ms=round(span_record['cpu'] * 1e3, 3),
+                         subprocesses=span_record['subprocesses'], peak_rss_mb=span_record['peak_rss_mb']),
+        } for span_record in self.spans]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+# Process-wide recorder used by the collection stage and the CLI
+SPANS = SpanRecorder()
+
+def span(name, category='stage', **args):
+    """Time the enclosed block as one span of the process-wide recorder."""
+    return SPANS.span(name, category, **args)
+
+class ProbeError(RuntimeError):
+    """Raised when one or more environment probes fail during collection."""
+
+@dataclass
+class EnvSnapshot:
+    """Packages and revision metadata of one environment, gathered once."""
+    name: str
+    prefix: str = None
+    packages: dict = field(default_factory=dict)
+    revision_count: object = 'Unknown'
+    first_revision_date: str = 'Unknown'
+    last_revision_date: str = 'Unknown'
+
+    @property
+    def package_count(self):
+        return len(self.packages)
+
+    def set_revision_statistics(self, stats):
+        """Store the result of get_revision_statistics() on the snapshot."""
+        self.revision_count = stats['Revision_Count']
+        self.first_revision_date = stats['Date_First_Created']
+        self.last_revision_date = stats['Latest_Revision_Date']
+
+    def statistics(self):
+        """Return the row shown in the environment statistics table."""
+        return {
+            'Date_First_Created': self.first_revision_date,
+            'Current_Packages_Count': self.package_count,
+            'Revision_Count': self.revision_count,
+            'Latest_Revision_Date': self.last_revision_date
+        }
+
+def get_conda_root():
+    """Locate the root (base) conda installation without launching conda."""
+    if os.environ.get('CONDA_ROOT'):
+        return os.environ['CONDA_ROOT']
+    conda_exe = os.environ.get('CONDA_EXE') or shutil.which('conda')
+    if conda_exe:
+        # <root>/bin/conda, <root>/condabin/conda or <root>\Scripts\conda.exe
+        root = os.path.dirname(os.path.dirname(os.path.realpath(conda_exe)))
+        if os.path.isdir(os.path.join(root, 'conda-meta')):
+            return root
+    return None
+
+def get_envs_dirs():
+    """Return the directories conda searches for named environments."""
+    dirs = []
+    for var in ('CONDA_ENVS_PATH', 'CONDA_ENVS_DIRS'):
+        dirs.extend(d for d in os.environ.get(var, '').split(os.pathsep) if d)
+    root = get_conda_root()
+    if root:
+        dirs.append(os.path.join(root, 'envs'))
+    dirs.append(os.path.join(os.path.expanduser('~'), '.conda', 'envs'))
+    return dirs
+
+def find_env_prefix(env_name):
+    """Resolve an environment name (or path) to its prefix, or None if not found."""
+    if os.path.isdir(os.path.join(env_name, 'conda-meta')):
+        return os.path.abspath(env_name)
+    if env_name in ('base', 'root'):
+        return get_conda_root()
+    for envs_dir in get_envs_dirs():
+        prefix = os.path.join(envs_dir, env_name)
+        if os.path.isdir(os.path.join(prefix, 'conda-meta')):
+            return prefix
+    # Environments created with --prefix are only recorded in environments.txt
+    registry = os.path.join(os.path.expanduser('~'), '.conda', 'environments.txt')
+    if os.path.isfile(registry):
+        with open(registry) as f:
+            for line in f:
+                prefix = line.strip()
+                if prefix and os.path.basename(prefix) == env_name and \
+                        os.path.isdir(os.path.join(prefix, 'conda-meta')):
+                    return prefix
+    return None
+
+def list_conda_envs(timeout=CONDA_TIMEOUT):
+    """List every known environment as a name (or prefix path) usable with get_env_list.
+    
+    Environments are discovered from the conda root, the envs directories and
+    ~/.conda/environments.txt without launching conda; `conda env list --json`
+    is only used when the conda root cannot be located.
+    """
+    root = get_conda_root()
+    if root is None:
+        output = run_conda(['env', 'list', '--json'], timeout=timeout)
+        prefixes = json.loads(output).get('envs', [])
+        root = prefixes[0] if prefixes else None
+    else:
+        prefixes = [root]
+        for envs_dir in get_envs_dirs():
+            prefixes.extend(sorted(glob.glob(os.path.join(envs_dir, '*', 'conda-meta'))))
+        prefixes = [os.path.dirname(p) if p.endswith('conda-meta') else p for p in prefixes]
+        registry = os.path.join(os.path.expanduser('~'), '.conda', 'environments.txt')
+        if os.path.isfile(registry):
+            with open(registry) as f:
+                prefixes.extend(line.strip() for line in f if line.strip())
+    
+    env_names = []
+    seen = set()
+    for prefix in prefixes:
+        real_prefix = os.path.realpath(prefix)
+        if real_prefix in seen or not os.path.isdir(os.path.join(prefix, 'conda-meta')):
+            continue
+        seen.add(real_prefix)
+        if root and real_prefix == os.path.realpath(root):
+            env_names.append('base')
+        elif find_env_prefix(os.path.basename(prefix)) == prefix:
+            env_names.append(os.path.basename(prefix))
+        else:
+            env_names.append(prefix)
+    return env_names
+
+def get_channel_name(record):
+    """Reduce a conda-meta channel URL to the name `conda list` would show."""
+    channel = (record.get('schannel') or record.get('channel') or '').rstrip('/')
+    channel = SUBDIR_SUFFIX.sub('', channel)
+    if '://' in channel:
+        host, _, path = channel.split('://', 1)[1].partition('/')
+        if host in ANACONDA_HOSTS:
+            channel = path
+    if not channel or channel in DEFAULT_CHANNELS:
+        return 'defaults'
+    return channel
+
+def site_package_dirs(prefix):
+    """Return the existing site-packages folders of an environment (Unix and Windows layouts)."""
+    site_dirs = glob.glob(os.path.join(prefix, 'lib', 'python*', 'site-packages'))
+    site_dirs.append(os.path.join(prefix, 'Lib', 'site-packages'))  # Windows layout
+    return [site_dir for site_dir in site_dirs if os.path.isdir(site_dir)]
+
+def get_pip_packages(prefix):
+    """Get pip-installed packages from the *.dist-info folders of an environment."""
+    pkgs = {}
+    for site_dir in site_package_dirs(prefix):
+        for dist_info in glob.glob(os.path.join(site_dir, '*.dist-info')):
+            try:
+                with open(os.path.join(dist_info, 'INSTALLER')) as f:
+                    installer = f.read().strip()
+            except OSError:
+                installer = ''
+            if installer == 'conda':
+                continue  # Already listed through its conda-meta record
+            name, _, version = os.path.basename(dist_info)[:-len('.dist-info')].rpartition('-')
+            if not name:
+                continue
+            name = re.sub(r'[-_.]+', '-', name).lower()
+            pkgs[name] = {'version': version, 'build': 'pypi_0', 'channel': 'pypi'}
+    return pkgs
+
+def parse_package_record(record):
+    """Reduce a decoded conda-meta record to a (name, {version, build, channel}) pair."""
+    return record['name'], {
+        'version': record['version'],
+        'build': record.get('build', ''),
+        'channel': get_channel_name(record)
+    }
+
+def read_package_record(record_file):
+    """Read one conda-meta/*.json record as a (name, {version, build, channel}) pair."""
+    with open(record_file, 'rb') as f:
+        return parse_package_record(json.loads(f.read()))
+
+def read_conda_meta(prefix, include_pip=True):
+    """Get list of packages by parsing <prefix>/conda-meta/*.json directly."""
+    pkgs = dict(read_package_record(record_file)
+                for record_file in glob.glob(os.path.join(prefix, 'conda-meta', '*.json')))
+    if include_pip:
+        for pkg, info in get_pip_packages(prefix).items():
+            pkgs.setdefault(pkg, info)
+    return dict(sorted(pkgs.items()))
+
+def get_env_list(env_name, timeout=CONDA_TIMEOUT):
+    """Get list of packages from conda environment."""
+    prefix = find_env_prefix(env_name)
+    if prefix:
+        try:
+            return read_conda_meta(prefix)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: Could not read conda-meta for {env_name}, using conda list: {str(e)}")
+    return get_env_list_from_conda(env_name, timeout=timeout)
+
+class SnapshotCache:
+    """On-disk cache of EnvSnapshots keyed by environment prefix.
+    
+    An entry is only reused while the size and mtime of the environment's
+    conda-meta/history file (and the mtimes of its site-packages folders,
+    which pip updates without touching history) are unchanged. Entries are
+    evicted least-recently-used first once the cache exceeds max_bytes.
+    """
+    
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+    
+    def entry_path(self, prefix):
+        key = hashlib.sha1(os.path.abspath(prefix).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{key}.json')
+    
+    @staticmethod
+    def history_stamp(prefix):
+        """Return the validation stamp for a prefix, or None if it has no history file."""
+        try:
+            st = os.stat(os.path.join(prefix, 'conda-meta', 'history'))
+        except OSError:
+            return None
+        site_mtimes = sorted(os.stat(d).st_mtime_ns for d in site_package_dirs(prefix))
+        return [st.st_size, st.st_mtime_ns, site_mtimes]
+    
+    def load(self, prefix):
+        """Return the cached EnvSnapshot for a prefix, or None if missing or stale."""
+        path = self.entry_path(prefix)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        stamp = self.history_stamp(prefix)
+        if entry.get('version') != CACHE_VERSION or stamp is None or entry.get('stamp') != stamp:
+            return None
+        try:
+            os.utime(path)  # Record the hit for LRU eviction
+        except OSError:
+            pass
+        return EnvSnapshot(**entry['snapshot'])
+    
+    def store(self, snapshot):
+        """Write a snapshot to the cache and evict old entries if over the size limit."""
+        stamp = self.history_stamp(snapshot.prefix)
+        if stamp is None:
+            return
+        entry = {'version': CACHE_VERSION, 'stamp': stamp, 'snapshot': asdict(snapshot)}
+        path = self.entry_path(snapshot.prefix)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            self.evict()
+        except OSError as e:
+            print(f"Warning: Could not write snapshot cache for {snapshot.name}: {str(e)}")
+    
+    def evict(self):
+        """Delete least-recently-used entries until the cache fits in max_bytes."""
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.json')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+def run_conda(args, timeout=CONDA_TIMEOUT):
+    """Run a conda command without a shell and return its decoded stdout."""
+    conda_exe = os.environ.get('CONDA_EXE') or shutil.which('conda') or 'conda'
+    # Span name without the environment, e.g. 'conda list --revisions'
+    command = ' '.join(takewhile(lambda arg: arg not in ('-n', '-p'), args))
+    with span(f'conda {command}', category='subprocess', args=args):
+        SPANS.count_subprocess()
+        result = subprocess.run([conda_exe] + args, capture_output=True, check=True, timeout=timeout)
+    return result.stdout.decode('utf-8')
+
+def env_target_args(env_name):
+    """Return the conda CLI arguments selecting an environment by name or by prefix path."""
+    if os.sep in env_name or (os.altsep and os.altsep in env_name) or \
+            os.path.isdir(os.path.join(env_name, 'conda-meta')):
+        return ['-p', os.path.abspath(env_name)]
+    return ['-n', env_name]
+
+def get_env_list_from_conda(env_name, timeout=CONDA_TIMEOUT):
+    """Get list of packages by parsing the output of `conda list`."""
+    print("conda list -n " + env_name)
+    return parse_conda_list(run_conda(['list'] + env_target_args(env_name), timeout=timeout))
+
+def parse_conda_list(pkg_list):
+    """Parse the text output of `conda list` into a package dict."""
+    pkgs = {}
+    for line in pkg_list.split('\n'):
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        parts = line.split()
+        pkg, version, build = parts[:3]
+        channel = "pip" if build == '<pip>' else ("defaults" if len(parts) < 4 else parts[3])
+        pkgs[pkg] = {'version': version, 'build': build, 'channel': channel}
+    
+    return pkgs
+
+def parse_history_bytes(data, revisions, base_offset):
+    """Parse complete history lines from data, extending the revisions list in place.
+    
+    Returns the number of bytes consumed; a trailing partial line is left
+    for the next call so it is parsed once it has been fully written.
+    """
+    consumed = data.rfind(b'\n') + 1
+    offset = base_offset
+    for line in data[:consumed].splitlines(keepends=True):
+        match = HISTORY_HEADER.match(line)
+        if match:
+            revisions.append({
+                'rev': len(revisions),
+                'date': match.group(1).decode('utf-8', 'replace').strip(),
+                'offset': offset,
+                'added': 0,
+                'removed': 0
+            })
+        elif revisions and line[:1] == b'+':
+            revisions[-1]['added'] += 1
+        elif revisions and line[:1] == b'-':
+            revisions[-1]['removed'] += 1
+        offset += len(line)
+    return consumed
+
+def read_history_index(prefix, cache_dir=CACHE_DIR):
+    """Index the revisions of <prefix>/conda-meta/history, parsing only appended bytes.
+    
+    Each revision records its date, the byte offset of its header and its
+    number of added/removed packages. The index is persisted in cache_dir
+    (when given) together with the offset parsed so far; later calls read
+    only the bytes appended since then. A history file that shrank or whose
+    first line changed is re-indexed from scratch.
+    """
+    history_file = os.path.join(prefix, 'conda-meta', 'history')
+    index_path = None
+    state = None
+    if cache_dir:
+        key = hashlib.sha1(os.path.abspath(prefix).encode('utf-8')).hexdigest()
+        index_path = os.path.join(cache_dir, f'history-{key}.json')
+        try:
+            with open(index_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+    
+    with open(history_file, 'rb') as f:
+        head = f.readline()[:HISTORY_HEAD_BYTES].decode('utf-8', 'replace')
+        size = os.fstat(f.fileno()).st_size
+        if not state or state.get('version') != CACHE_VERSION or state.get('head') != head or \
+                state.get('offset', 0) > size:
+            state = {'version': CACHE_VERSION, 'head': head, 'offset': 0, 'revisions': []}
+        if size == state['offset']:
+            return state['revisions']
+        f.seek(state['offset'])
+        state['offset'] += parse_history_bytes(f.read(), state['revisions'], state['offset'])
+    
+    if index_path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f'{index_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"Warning: Could not write history index for {prefix}: {str(e)}")
+    return state['revisions']
+
+def get_revision_statistics(env_name, timeout=CONDA_TIMEOUT, cache_dir=CACHE_DIR):
+    """Get revision count and first/last revision dates of an environment.
+    
+    Reads <prefix>/conda-meta/history directly (see read_history_index) and
+    only falls back to `conda list --revisions` when the prefix or its
+    history file cannot be found.
+    """
+    prefix = find_env_prefix(env_name)
+    if prefix and os.path.isfile(os.path.join(prefix, 'conda-meta', 'history')):
+        try:
+            revisions = read_history_index(prefix, cache_dir=cache_dir)
+            dates = [revision['date'] for revision in revisions]
+        except OSError as e:
+            print(f"Warning: Could not read conda-meta/history for {env_name}, using conda: {str(e)}")
+        else:
+            return {
+                'Date_First_Created': dates[0] if dates else 'Unknown',
+                'Revision_Count': len(dates),
+                'Latest_Revision_Date': dates[-1] if dates else 'Unknown'
+            }
+    
+    try:
+        print(f"Getting revision history for {env_name}...")
+        output = run_conda(['list', '--revisions'] + env_target_args(env_name), timeout=timeout)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+        print(f"Warning: Could not get revision history for {env_name}: {str(e)}")
+        return {
+            'Date_First_Created': 'Unknown',
+            'Revision_Count': 'Unknown',
+            'Latest_Revision_Date': 'Unknown'
+        }
+    
+    # Only the '<date> <time>  (rev N)' lines start a revision
+    dates = [match.group(1) for match in REVISION_LINE.finditer(output)]
+    return {
+        'Date_First_Created': dates[0] if dates else 'Unknown',
+        'Revision_Count': len(dates),
+        'Latest_Revision_Date': dates[-1] if dates else 'Unknown'
+    }
+
+@lru_cache(maxsize=None)
+def get_history_channel_name(channel):
+    """Channel name `conda list` would show for the channel prefix of a history entry."""
+    return get_channel_name({'channel': channel})
+
+def parse_history_dist(dist):
+    """Split a history entry like 'conda-forge::numpy-1.26.4-py311h_0' into (name, record)."""
+    channel, _, dist = dist.rpartition('::')
+    name, version, build = dist.rsplit('-', 2)
+    return name, {'version': version, 'build': build, 'channel': get_history_channel_name(channel)}
+
+class HistoryTimeline:
+    """Package state of an environment at every revision, replayed from conda-meta/history.
+    
+    Each revision is stored as a delta (packages added and names removed,
+    taken from its '+' and '-' lines), plus a full keyframe of the state
+    every keyframe_interval revisions. state_at() therefore starts from the
+    nearest keyframe and applies fewer than keyframe_interval deltas.
+    pip packages are not recorded in the history and are never included.
+    """
+    
+    def __init__(self, prefix, keyframe_interval=HISTORY_KEYFRAME_INTERVAL):
+        self.prefix = prefix
+        self.keyframe_interval = keyframe_interval
+        self.revisions = []
+        with open(os.path.join(prefix, 'conda-meta', 'history'), 'rb') as f:
+            data = f.read()
+        for line in data.splitlines():
+            match = HISTORY_HEADER.match(line)
+            if match:
+                self.revisions.append({'date': match.group(1).decode('utf-8', 'replace').strip(),
+                                       'added': {}, 'removed': []})
+            elif self.revisions and line[:1] == b'+':
+                try:
+                    name, info = parse_history_dist(line[1:].decode('utf-8', 'replace').strip())
+                except ValueError:
+                    continue
+                self.revisions[-1]['added'][name] = info
+            elif self.revisions and line[:1] == b'-':
+                # Only the name of a removed package matters
+                dist = line[1:].decode('utf-8', 'replace').strip().rpartition('::')[2]
+                self.revisions[-1]['removed'].append(dist.rsplit('-', 2)[0])
+        
+        self.keyframes = {}
+        state = {}
+        for rev, revision in enumerate(self.revisions):
+            self.apply(state, revision)
+            if rev % keyframe_interval == 0:
+                self.keyframes[rev] = dict(state)
+    
+    @staticmethod
+    def apply(state, revision):
+        """Apply one revision's delta to a package state in place."""
+        for name in revision['removed']:
+            state.pop(name, None)
+        state.update(revision['added'])
+    
+    def state_at(self, rev):
+        """Return the {name: record} packages of the environment right after revision rev."""
+        if not 0 <= rev < len(self.revisions):
+            raise ValueError(f"revision {rev} does not exist in {self.prefix} "
+                             f"(revisions 0-{len(self.revisions) - 1})")
+        base = rev - rev % self.keyframe_interval
+        state = dict(self.keyframes[base])
+        for revision in self.revisions[base + 1:rev + 1]:
+            self.apply(state, revision)
+        return dict(sorted(state.items()))
+    
+    def snapshot(self, name, rev):
+        """Return the environment at revision rev as an EnvSnapshot."""
+        return EnvSnapshot(name=name, prefix=self.prefix, packages=self.state_at(rev),
+                           revision_count=rev + 1,
+                           first_revision_date=self.revisions[0]['date'],
+                           last_revision_date=self.revisions[rev]['date'])
+
+def parse_revision_spec(env_spec):
+    """Split 'env@rev12' (or 'env@12') into ('env', 12); returns (env_spec, None) otherwise."""
+    match = REVISION_SPEC.match(env_spec)
+    if match is None or os.path.isdir(os.path.join(env_spec, 'conda-meta')):
+        return env_spec, None
+    return match.group(1), int(match.group(2))
+
+def collect_revision_snapshots(env_specs):
+    """Reconstruct snapshots for 'env@rev' specs, replaying each history file once.
+    
+    Returns a dict mapping each spec to its EnvSnapshot; failures are
+    gathered and raised together as a ProbeError.
+    """
+    timelines = {}
+    snapshots = {}
+    errors = []
+    for env_spec in env_specs:
+        env_name, rev = parse_revision_spec(env_spec)
+        prefix = find_env_prefix(env_name)
+        if prefix is None:
+            errors.append(f"revision snapshot '{env_spec}' failed: no local prefix found for '{env_name}'")
+            continue
+        try:
+            with span('history replay', category='probe', env=env_name):
+                if prefix not in timelines:
+                    timelines[prefix] = HistoryTimeline(prefix)
+                snapshots[env_spec] = timelines[prefix].snapshot(env_spec, rev)
+        except (OSError, ValueError) as e:
+            errors.append(f"revision snapshot '{env_spec}' failed: {str(e)}")
+    if errors:
+        raise ProbeError('\n'.join(errors))
+    return snapshots
+
+# Exported formats that record no channel: their conda packages get an empty one
+CHANNEL_LESS_FORMATS = ('export', 'environment.yml')
+# A file given by bare name must carry one of these to be read as an exported environment
+EXPORT_EXTENSIONS = ('.yml', '.yaml', '.txt', '.json', '.lock')
+
+def detect_export_format(text):
+    """Guess which EXPORT_FORMATS entry an exported environment file is in."""
+    if text.lstrip().startswith(('[', '{')):
+        return 'json'
+    lines = [line.strip() for line in text.splitlines()]
+    if '@EXPLICIT' in lines:
+        return 'explicit'
+    if any(line.startswith('dependencies:') for line in lines):
+        return 'environment.yml'
+    entries = [line for line in lines if line and not line.startswith('#')]
+    if entries and all('=' in line and len(line.split()) == 1 for line in entries[:20]):
+        return 'export'
+    return 'list'
+
+def parse_conda_export(text):
+    """Parse `conda list --export` (name=version=build lines) into a package dict.
+    
+    The format carries no channel: conda packages get an empty one (see
+    drop_unknown_channels) and pip packages (build pypi_0) get 'pypi'.
+    """
+    pkgs = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        pkg, _, rest = line.partition('=')
+        version, _, build = rest.partition('=')
+        pkgs[pkg] = {'version': version, 'build': build,
+                     'channel': 'pypi' if build.startswith('pypi_') else ''}
+    return pkgs
+
+def parse_explicit_lockfile(text):
+    """Parse an @EXPLICIT lockfile (`conda list --explicit`) of package URLs into a package dict."""
+    pkgs = {}
+    explicit = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '@EXPLICIT':
+            explicit = True
+            continue
+        if not explicit or not line or line[0] == '#':
+            continue
+        url = line.split('#', 1)[0]
+        base_url, _, filename = url.rpartition('/')
+        for suffix in ('.conda', '.tar.bz2'):
+            if filename.endswith(suffix):
+                filename = filename[:-len(suffix)]
+        pkg, version, build = filename.rsplit('-', 2)
+        pkgs[pkg] = {'version': version, 'build': build, 'channel': get_channel_name({'channel': base_url})}
+    return pkgs
+
+def parse_conda_list_json(text):
+    """Parse `conda list --json` into a package dict."""
+    pkgs = {}
+    for record in json.loads(text):
+        channel = 'pypi' if record.get('channel') == 'pypi' else get_channel_name(record)
+        pkgs[record['name']] = {'version': record['version'], 'build': record.get('build_string', ''),
+                                'channel': channel}
+    return pkgs
+
+def parse_environment_yml(text, channels=None):
+    """Parse an environment.yml (as written by `conda env export`) into a package dict.
+    
+    Only the layout conda writes is handled: top-level keys, '- item' lists
+    and one nested '- pip:' list, so no YAML library is needed. A dependency
+    gets the channel of its 'channel::' prefix, or else an empty one (the
+    channels list does not say which channel a package came from); pip
+    dependencies get 'pypi'. Specs without an exact version keep
+    their constraint (e.g. '>=1.26') as the version. The listed channels are
+    appended to the channels list, if one is given.
+    """
+    channels = [] if channels is None else channels
+    pkgs = {}
+    section = None
+    pip_indent = 0
+    for line in text.splitlines():
+        stripped = line.split(' #', 1)[0].strip()
+        if not stripped or stripped[0] == '#':
+            continue
+        if not line.startswith((' ', '-')):
+            section = stripped.split(':', 1)[0]
+            continue
+        indent = len(line) - len(line.lstrip())
+        item = stripped[1:].strip() if stripped[0] == '-' else stripped
+        if section == 'channels':
+            channels.append(item)
+        elif section == 'dependencies' and item == 'pip:':
+            section, pip_indent = 'pip', indent
+        elif section == 'pip' and indent > pip_indent:
+            match = re.match(r'([^\s=<>!~\[]+)(?:\[[^\]]*\])?\s*(==|>=|<=|~=|!=|>|<)?\s*(.*)', item)
+            pkg = re.sub(r'[-_.]+', '-', match.group(1)).lower()
+            op, version = match.group(2) or '', match.group(3)
+            pkgs[pkg] = {'version': version if op == '==' else op + version, 'build': 'pypi_0', 'channel': 'pypi'}
+        elif section in ('dependencies', 'pip'):
+            section = 'dependencies'
+            channel, _, spec = item.rpartition('::')
+            match = re.match(r'([^\s=<>!~]+)\s*(.*)', spec)
+            pkg, constraint = match.group(1), match.group(2).replace(' ', '')
+            version, build = constraint, ''
+            if constraint.startswith('=') and not constraint.startswith('=='):
+                version, _, build = constraint[1:].partition('=')
+            elif constraint.startswith('=='):
+                version = constraint[2:]
+            pkgs[pkg] = {'version': version, 'build': build,
+                         'channel': get_channel_name({'channel': channel}) if channel else ''}
+    return pkgs
+
+EXPORT_PARSERS = {
+    'environment.yml': parse_environment_yml,
+    'export': parse_conda_export,
+    'explicit': parse_explicit_lockfile,
+    'json': parse_conda_list_json,
+    'list': parse_conda_list,
+}
+
+def load_export_file(path):
+    """Read an exported environment file of any EXPORT_PARSERS format as an EnvSnapshot, without conda."""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    export_format = detect_export_format(text)
+    try:
+        pkgs = EXPORT_PARSERS[export_format](text)
+    except (ValueError, KeyError, IndexError, AttributeError, TypeError) as e:
+        raise ValueError(f"not a valid {export_format} file ({e.__class__.__name__}: {str(e)})") from e
+    return EnvSnapshot(name=path, packages=dict(sorted(pkgs.items())))
+
+def is_export_file(env_spec):
+    """Exported environment files are given by path; environments are names or prefix directories.
+    
+    A bare name is only read as a file when it has an EXPORT_EXTENSIONS
+    suffix, so a stray file in the working directory cannot shadow an
+    environment of the same name.
+    """
+    if not os.path.isfile(env_spec):
+        return False
+    return os.sep in env_spec or '/' in env_spec or env_spec.lower().endswith(EXPORT_EXTENSIONS)
+
+def drop_unknown_channels(snapshots):
+    """Blank the channel of every package whose channel some snapshot does not record.
+    
+    Packages read from CHANNEL_LESS_FORMATS files have an empty channel, so
+    they are compared on version and build only instead of diverging on a
+    guessed channel. Returns new snapshots; the given ones are not changed.
+    """
+    unknown = {pkg for snapshot in snapshots for pkg, info in snapshot.packages.items() if not info['channel']}
+    if not unknown:
+        return snapshots
+    return [replace(snapshot, packages={pkg: dict(info, channel='') if pkg in unknown else info
+                                        for pkg, info in snapshot.packages.items()})
+            for snapshot in snapshots]
+
+def collect_export_snapshots(env_specs):
+    """Load every exported environment file; failures are raised together as a ProbeError."""
+    snapshots = {}
+    errors = []
+    for env_spec in env_specs:
+        try:
+            with span('export parse', category='probe', env=env_spec):
+                snapshots[env_spec] = load_export_file(env_spec)
+        except (OSError, ValueError) as e:
+            errors.append(f"exported file '{env_spec}' failed: {str(e)}")
+    if errors:
+        raise ProbeError('\n'.join(errors))
+    return snapshots
+
+def take_snapshot(env_name, timeout=CONDA_TIMEOUT):
+    """Gather packages and revision statistics for one environment in a single pass."""
+    snapshot = EnvSnapshot(name=env_name, prefix=find_env_prefix(env_name))
+    snapshot.packages = get_env_list(env_name, timeout=timeout)
+    snapshot.set_revision_statistics(get_revision_statistics(env_name, timeout=timeout))
+    return snapshot
+
+def get_env_statistics(env_name, timeout=CONDA_TIMEOUT):
+    """Get environment statistics using conda list --revisions."""
+    return take_snapshot(env_name, timeout=timeout).statistics()
+
+def run_probe(probe_name, probe, env_name, timeout):
+    """Run one per-environment probe inside an instrumentation span."""
+    with span(f'{probe_name} probe', category='probe', env=env_name):
+        return probe(env_name, timeout=timeout)
+
+def collect_snapshots(env_names, max_workers=MAX_WORKERS, timeout=CONDA_TIMEOUT,
+                      cache=None, refresh=False, with_revisions=True):
+    """Run every per-environment probe concurrently on a bounded thread pool.
+    
+    Environments with a valid entry in the snapshot cache are not probed at
+    all (unless refresh is set); freshly probed snapshots are stored back.
+    With with_revisions=False only package lists are collected, and the
+    resulting partial snapshots are not written to the cache.
+    Returns a dict mapping each environment name to its EnvSnapshot. Probe
+    failures are gathered and re-raised together as a ProbeError once all
+    probes have finished.
+    """
+    prefixes = {env_name: find_env_prefix(env_name) for env_name in env_names}
+    snapshots = {}
+    if cache is not None and not refresh:
+        with span('cache load', category='cache'):
+            for env_name, prefix in prefixes.items():
+                snapshot = cache.load(prefix) if prefix else None
+                if snapshot is not None:
+                    snapshot.name = env_name
+                    snapshots[env_name] = snapshot
+    pending = [env_name for env_name in env_names if env_name not in snapshots]
+    if not pending:
+        return {env_name: snapshots[env_name] for env_name in env_names}
+    # Imported here: fully cached runs (such as --check) never start a thread pool
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    
+    probes = {'packages': get_env_list}
+    if with_revisions:
+        probes['revisions'] = partial(get_revision_statistics,
+                                      cache_dir=cache.cache_dir if cache is not None else None)
+    results = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(run_probe, probe_name, probe, env_name, timeout): (env_name, probe_name)
+            for env_name in pending
+            for probe_name, probe in probes.items()
+        }
+        for future in as_completed(futures):
+            env_name, probe_name = futures[future]
+            try:
+                results[env_name, probe_name] = future.result()
+            except subprocess.CalledProcessError as e:
+                stderr = (e.stderr or b'').decode('utf-8', 'replace').strip()
+                errors.append(f"{probe_name} probe for '{env_name}' failed: {stderr or e}")
+            except (subprocess.TimeoutExpired, OSError, ValueError) as e:
+                errors.append(f"{probe_name} probe for '{env_name}' failed: {str(e)}")
+    if errors:
+        raise ProbeError('\n'.join(errors))
+    
+    for env_name in pending:
+        snapshot = EnvSnapshot(name=env_name, prefix=prefixes[env_name],
+                               packages=results[env_name, 'packages'])
+        if with_revisions:
+            snapshot.set_revision_statistics(results[env_name, 'revisions'])
+            if cache is not None and snapshot.prefix:
+                cache.store(snapshot)
+        snapshots[env_name] = snapshot
+    return {env_name: snapshots[env_name] for env_name in env_names}
+
+def split_version(text):
+    """Split a version (without epoch or local part) into comparable tokens."""
+    key = []
+    for part in re.split(r'[._-]', text):
+        tokens = VERSION_TOKEN.findall(part)
+        if not tokens:
+            continue
+        if not key and not tokens[0].isdigit():
+            key.append(VERSION_FILLER)  # A leading tag sorts like '0<tag>'
+        for token in tokens:
+            if token.isdigit():
+                key.append((1, int(token), ''))
+            else:
+                key.append((VERSION_TAG_RANKS.get(token, 0), 0, token))
+    return tuple(key)
+
+@lru_cache(maxsize=None)
+def version_key(version):
+    """Parse a conda/PEP 440 style version once; None if it is missing or unparsable."""
+    if not isinstance(version, str):
+        return None
+    text = version.strip().lower()
+    epoch, _, text = text.rpartition('!')
+    text, _, local = text.partition('+')
+    main = split_version(text)
+    if not main or (epoch and not epoch.isdigit()):
+        return None
+    return (int(epoch or 0), main, split_version(local))
+
+def compare_version_keys(key1, key2):
+    """Compare two version keys, padding the shorter release with zeros like conda does."""
+    epoch1, main1, local1 = key1
+    epoch2, main2, local2 = key2
+    length = max(len(main1), len(main2))
+    main1 = main1 + (VERSION_FILLER,) * (length - len(main1))
+    main2 = main2 + (VERSION_FILLER,) * (length - len(main2))
+    left, right = (epoch1, main1, local1), (epoch2, main2, local2)
+    return (left > right) - (left < right)
+
+def package_record_key(info):
+    """Return the fields that decide whether two package records are the same."""
+    return (info['version'], info['build'], info['channel'])
+
+def classify_records(records):
+    """Status of one package given its record (or None) in every environment."""
+    if any(record is None for record in records):
+        return STATUS_PARTIAL
+    if len({package_record_key(record) for record in records}) == 1:
+        return STATUS_IDENTICAL
+    return STATUS_DIVERGENT
+
+def diff_snapshots(snapshots, packages=None):
+    """Classify every package of the snapshots as identical, divergent or partial.
+    
+    Uses the same rules as compare_environments but works on plain dicts
+    and one sorted list of package names. If packages is given, only those
+    package names are classified. Returns a dict mapping each status to a
+    sorted list of package names.
+    """
+    names = sorted(set().union(*(snapshot.packages for snapshot in snapshots)))
+    if packages is not None:
+        wanted = set(packages)
+        names = [name for name in names if name in wanted]
+    diff = {status: [] for status in STATUSES}
+    for name in names:
+        diff[classify_records([snapshot.packages.get(name) for snapshot in snapshots])].append(name)
+    return diff
+
+def diff_exit_status(diff):
+    """Exit status of a diff: 0 if nothing differs, 1 otherwise (like diff(1))."""
+    return EXIT_DIFFERENT if diff[STATUS_DIVERGENT] or diff[STATUS_PARTIAL] else EXIT_IDENTICAL
+
+class CondaMetaWatcher:
+    """Tracks the package records of one prefix, re-reading only files that changed.
+    
+    Every poll() lists conda-meta once and compares each *.json record's
+    (mtime, size) with the previous poll, so only added, removed or
+    rewritten records are parsed. pip packages are re-read only when the
+    mtime of a site-packages folder changed. The merged view follows
+    read_conda_meta: conda records win over pip ones of the same name.
+    """
+    
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.meta_dir = os.path.join(prefix, 'conda-meta')
+        self.files = {}          # record file name -> ((mtime_ns, size), package name)
+        self.conda_packages = {}
+        self.pip_stamp = None
+        self.pip_packages = {}
+        self.packages = {}
+        self.poll()
+    
+    def site_stamp(self):
+        """Return the mtimes of the prefix's site-packages folders."""
+        return sorted(os.stat(d).st_mtime_ns for d in site_package_dirs(self.prefix))
+    
+    def poll(self):
+        """Pick up changes since the last poll.
+        
+        Returns a dict mapping every package whose merged record changed to
+        an (old, new) pair of records, with None for absent.
+        """
+        changed = set()
+        seen = set()
+        with os.scandir(self.meta_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                seen.add(entry.name)
+                st = entry.stat()
+                stamp = (st.st_mtime_ns, st.st_size)
+                known = self.files.get(entry.name)
+                if known is not None and known[0] == stamp:
+                    continue
+                try:
+                    name, info = read_package_record(entry.path)
+                except (OSError, ValueError, KeyError):
+                    continue  # Still being written (or gone again); retried on the next poll
+                if known is not None and known[1] != name:
+                    self.conda_packages.pop(known[1], None)
+                    changed.add(known[1])
+                self.files[entry.name] = (stamp, name)
+                self.conda_packages[name] = info
+                changed.add(name)
+        for file_name in set(self.files) - seen:
+            _, name = self.files.pop(file_name)
+            # An upgrade removes one record file and adds another for the same name
+            if not any(other == name for _, other in self.files.values()):
+                self.conda_packages.pop(name, None)
+            changed.add(name)
+        
+        site_stamp = self.site_stamp()
+        if site_stamp != self.pip_stamp:
+            pip_packages = get_pip_packages(self.prefix)
+            changed.update(name for name in set(pip_packages) | set(self.pip_packages)
+                           if pip_packages.get(name) != self.pip_packages.get(name))
+            self.pip_stamp, self.pip_packages = site_stamp, pip_packages
+        
+        deltas = {}
+        for name in changed:
+            old = self.packages.get(name)
+            new = self.conda_packages.get(name) or self.pip_packages.get(name)
+            if new is None:
+                self.packages.pop(name, None)
+            else:
+                self.packages[name] = new
+            if old != new:
+                deltas[name] = (old, new)
+        return deltas
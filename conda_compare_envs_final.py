@@ -25,282 +25,653 @@ Updated by Rich Lysakowski
 - Enhanced table formatting with clear separators and borders
 - Added environment statistics comparison
 - Standardized table widths and formatting
+
+UPDATE: 2026-10-17
+- Read package lists natively from <prefix>/conda-meta/*.json (plus pip
+  *.dist-info folders), falling back to `conda list` only when the
+  environment prefix cannot be located
+- Collect all per-environment probes concurrently with per-command timeouts
+- Gather each environment once into an EnvSnapshot shared by the comparison,
+  statistics table and report file (no separate package-count conda call)
+- Cache snapshots under ~/.cache/conda_compare, invalidated when
+  conda-meta/history changes (--no-cache / --refresh)
+- Compare any number of environments at once with a single vectorised
+  N-way engine (compare_environments)
+- Precompute a version Direction column (older/newer/equal/incomparable)
+  with a memoised parser that understands conda-style versions
+- Read revision statistics from conda-meta/history with an incremental,
+  byte-offset index instead of `conda list --revisions`
+- Render each report table once and stream it to the console and the report
+  file (optionally gzip-compressed with --gzip)
+- Write machine-readable package and statistics tables with
+  --format jsonl/parquet/arrow (pyarrow needed for parquet and arrow)
+  instead of the text report
+- Write a self-contained HTML report with a virtualised client-side table
+  (--format html, see conda_compare_html.py)
+- Keep the comparison frame compact: categorical columns with one shared
+  string table per field, and partitions selected by row masks
+- Move snapshot collection, caching, version parsing and a plain-dict diff
+  into conda_compare_core.py (no pandas); pandas is imported only by the
+  table renderers
+- Add --check (optionally with --package NAME): print the differing packages
+  and exit 0/1/2 without importing pandas
+- Time every stage and conda subprocess (wall/CPU time, subprocess count,
+  peak memory): --timings summary, --trace Chrome trace file, --profile
+- Add --watch: poll both conda-meta folders, re-read only changed records
+  and print per-package deltas instead of the full report
+- Compare past states (env@rev12): replay conda-meta/history into a
+  keyframe + delta timeline and feed the same three-table report
+- Save environment states in a content-addressed snapshot store (--save,
+  conda_compare_store.py) and re-render old comparisons from it (store:<ref>)
+- Compare exported files without conda: a path to an environment.yml,
+  `conda list --export`, @EXPLICIT lockfile, `conda list --json` or
+  `conda list` output is auto-detected and parsed in place of a live
+  environment; packages whose channel the file does not record are
+  compared on version and build only
 """
 
 import sys
-import subprocess
-import pandas as pd
 from datetime import datetime
 import os
+import re
+import time
+import argparse
+from functools import cmp_to_key
+import gzip
 
-def get_env_list(env_name):
-    """Get list of packages from conda environment."""
-    cmd = "conda list -n " + env_name
-    print(cmd)
-    pkg_list = subprocess.check_output(cmd, shell=True)
-    pkg_list = pkg_list.decode('utf-8')
-    
-    pkgs = {}
-    for line in pkg_list.split('\n'):
-        line = line.strip()
-        if not line or line[0] == '#':
-            continue
-        parts = line.split()
-        pkg, version, build = parts[:3]
-        channel = "pip" if build == '<pip>' else ("defaults" if len(parts) < 4 else parts[3])
-        pkgs[pkg] = {'version': version, 'build': build, 'channel': channel}
-    
-    return pkgs
-
-def get_env_statistics(env_name):
-    """Get environment statistics using conda list --revisions."""
-    cmd = f"conda list --revisions -n {env_name}"
-    try:
-        print(f"Getting revision history for {env_name}...")
-        revisions = subprocess.check_output(cmd, shell=True).decode('utf-8').splitlines()
-        
-        # Filter out empty lines and comments
-        revisions = [rev for rev in revisions if rev.strip() and not rev.startswith('#')]
-        revision_count = len(revisions)
-        
-        # Safely get first and last revision dates
-        first_date = 'Unknown'
-        last_date = 'Unknown'
-        
-        if revision_count > 0:
-            try:
-                # Get first revision date
-                first_parts = revisions[0].split()
-                if len(first_parts) > 1:
-                    first_date = first_parts[1]
-                
-                # Get last revision date
-                last_parts = revisions[-1].split()
-                if len(last_parts) > 1:
-                    last_date = last_parts[1]
-            except (IndexError, ValueError) as e:
-                print(f"Warning: Error parsing revision dates for {env_name}: {str(e)}")
-        
-        # Get current package count safely
-        try:
-            if os.name == 'nt':  # Windows
-                pkg_count_cmd = f"conda list -n {env_name} | findstr /v /b #"
-            else:  # Unix-like
-                pkg_count_cmd = f"conda list -n {env_name} | grep -v '^#' | wc -l"
-            
-            current_pkg_count = len([line for line in subprocess.check_output(pkg_count_cmd, shell=True)
-                                   .decode('utf-8').splitlines() if line.strip()])
-        except subprocess.CalledProcessError as e:
-            print(f"Warning: Error getting package count for {env_name}: {str(e)}")
-            current_pkg_count = 'Unknown'
-        
-        return {
-            'Date_First_Created': first_date,
-            'Current_Packages_Count': current_pkg_count,
-            'Revision_Count': revision_count,
-            'Latest_Revision_Date': last_date
-        }
-    except subprocess.CalledProcessError as e:
-        print(f"Warning: Could not get revision history for {env_name}: {str(e)}")
-        return {
-            'Date_First_Created': 'Unknown',
-            'Current_Packages_Count': 'Unknown',
-            'Revision_Count': 'Unknown',
-            'Latest_Revision_Date': 'Unknown'
-        }
-
-def create_comparison_dataframes(env1_name, env1, env2_name, env2):
+from conda_compare_core import (
+    CACHE_DIR, COMPARISON_FIELDS, CONDA_TIMEOUT, DIRECTION_EQUAL, DIRECTION_INCOMPARABLE,
+    DIRECTION_NEWER, DIRECTION_OLDER, DIRECTIONS, EXIT_ERROR, EXIT_IDENTICAL, MAX_WORKERS,
+    SPANS, STATUS_DIVERGENT, STATUS_IDENTICAL, STATUS_PARTIAL, STATUSES, STORE_PATH, STORE_PREFIX,
+    CondaMetaWatcher, ProbeError, SnapshotCache, classify_records, collect_export_snapshots,
+    collect_revision_snapshots, collect_snapshots, compare_version_keys, diff_exit_status, diff_snapshots,
+    drop_unknown_channels, find_env_prefix, is_export_file, parse_revision_spec, span, version_key,
+)
+
+# Report outputs (--format): section names and schema version of the columnar package table
+OUTPUT_FORMATS = ('txt', 'html', 'jsonl', 'parquet', 'arrow')
+SECTION_NAMES = {STATUS_IDENTICAL: 'same', STATUS_DIVERGENT: 'different', STATUS_PARTIAL: 'unique'}
+REPORT_SCHEMA_VERSION = 1
+
+# Poll interval of --watch, in seconds
+WATCH_INTERVAL = 1.0
+
+def create_statistics_dataframe(snapshots):
+    """Create the environment statistics table from a list of snapshots."""
+    import pandas as pd
+    
+    stats = [snapshot.statistics() for snapshot in snapshots]
+    return pd.DataFrame({
+        'Environment': [snapshot.name for snapshot in snapshots],
+        'Date_First_Created': [s['Date_First_Created'] for s in stats],
+        'Current_Packages_Count': [s['Current_Packages_Count'] for s in stats],
+        'Revision_Count': [s['Revision_Count'] for s in stats],
+        'Latest_Revision_Date': [s['Latest_Revision_Date'] for s in stats]
+    })
+
+def rank_versions(versions):
+    """Return a dense ordering rank per version string (NaN where unparsable)."""
+    import numpy as np
+    
+    keys = [version_key(v) for v in versions]
+    order = sorted((i for i, key in enumerate(keys) if key is not None),
+                   key=cmp_to_key(lambda i, j: compare_version_keys(keys[i], keys[j])))
+    ranks = np.full(len(versions), np.nan)
+    rank = 0
+    for position, i in enumerate(order):
+        if position and compare_version_keys(keys[order[position - 1]], keys[i]) != 0:
+            rank += 1
+        ranks[i] = rank
+    return ranks
+
+def classify_directions(reference_ranks, ranks):
+    """Turn two arrays of version ranks into older/newer/equal/incomparable labels."""
+    import numpy as np
+    
+    directions = np.select(
+        [np.isnan(reference_ranks) | np.isnan(ranks), ranks > reference_ranks, ranks < reference_ranks],
+        [DIRECTION_INCOMPARABLE, DIRECTION_NEWER, DIRECTION_OLDER],
+        DIRECTION_EQUAL)
+    return directions.astype(object)
+
+def version_directions(reference_versions, versions):
+    """Classify each version as older/newer/equal/incomparable relative to the reference.
+    
+    Every distinct version string is parsed and ranked once, so the cost
+    is one sort of the distinct versions plus NumPy comparisons per row.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    reference_versions = np.asarray(reference_versions, dtype=object)
+    versions = np.asarray(versions, dtype=object)
+    codes, uniques = pd.factorize(np.concatenate([reference_versions, versions]))
+    ranks = np.append(rank_versions(list(uniques)), np.nan)[codes]  # code -1 (missing) -> NaN
+    return classify_directions(ranks[:len(reference_versions)], ranks[len(reference_versions):])
+
+def compare_environments(snapshots):
+    """Compare any number of snapshots in a single vectorised pass.
+    
+    Returns one wide DataFrame with a ('Package', 'Name') column, a
+    (env, 'Version'/'Build'/'Channel') column group per environment and a
+    ('Package', 'Status') column classifying every package as identical
+    (same record everywhere), divergent (present everywhere, records
+    differ) or partial (missing from at least one environment). Absent
+    records are NaN. Cost is linear in the total number of package records.
+    
+    Every environment after the first also gets an (env, 'Direction')
+    column telling whether its version is older, newer, equal or
+    incomparable relative to the first environment, so styling and reports
+    never need to parse versions themselves.
+    
+    All columns except the package name are categoricals. The Version,
+    Build and Channel columns of every environment share one category
+    table per field, so each distinct string is stored once no matter how
+    many environments or rows contain it.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    env_names = [snapshot.name for snapshot in snapshots]
+    
+    # One long frame holding every (package, environment) record
+    long_df = pd.DataFrame.from_records(
+        [(pkg, env_idx, info['version'], info['build'], info['channel'])
+         for env_idx, snapshot in enumerate(snapshots)
+         for pkg, info in snapshot.packages.items()],
+        columns=['pkg_name', 'env_idx', 'Version', 'Build', 'Channel'])
+    pkg_idx, pkg_names = pd.factorize(long_df['pkg_name'], sort=True)
+    env_idx = long_df['env_idx'].to_numpy(dtype=np.intp)
+    shape = (len(pkg_names), len(snapshots))
+    
+    # Intern each field once and scatter its codes into a packages x environments grid (-1 = absent)
+    categories = {}
+    grids = {}
+    for field_name in COMPARISON_FIELDS:
+        field_codes, categories[field_name] = pd.factorize(long_df[field_name])
+        grid = np.full(shape, -1, dtype=np.int32)
+        grid[pkg_idx, env_idx] = field_codes
+        grids[field_name] = grid
+    del long_df
+    
+    # Integer code per distinct (version, build, channel) record; -1 where absent
+    codes = (grids['Version'].astype(np.int64) * len(categories['Build']) + grids['Build']) \
+        * len(categories['Channel']) + grids['Channel']
+    partial = (grids['Version'] < 0).any(axis=1)
+    identical = ~partial & (codes.min(axis=1) == codes.max(axis=1))
+    status = np.where(partial, STATUS_PARTIAL, np.where(identical, STATUS_IDENTICAL, STATUS_DIVERGENT))
+    
+    # Rank every distinct version once; NaN for absent or unparsable versions
+    version_ranks = np.append(rank_versions(list(categories['Version'])), np.nan)[grids['Version']]
+    
+    data = {('Package', 'Name'): np.asarray(pkg_names, dtype=object)}
+    for i, env_name in enumerate(env_names):
+        for field_name in COMPARISON_FIELDS:
+            data[(env_name, field_name)] = pd.Categorical.from_codes(grids[field_name][:, i],
+                                                                     categories=categories[field_name])
+        if i:
+            directions = classify_directions(version_ranks[:, 0], version_ranks[:, i])
+            directions[partial & ((grids['Version'][:, 0] < 0) | (grids['Version'][:, i] < 0))] = np.nan
+            data[(env_name, 'Direction')] = pd.Categorical(directions, categories=DIRECTIONS)
+    data[('Package', 'Status')] = pd.Categorical(status, categories=STATUSES)
+    comparison = pd.DataFrame(data)
+    comparison.columns = pd.MultiIndex.from_tuples(data.keys())
+    return comparison
+
+def create_comparison_dataframes(*snapshots):
     """Create multi-index DataFrames for package comparison."""
-    # Create initial DataFrames
-    df1 = pd.DataFrame.from_dict(env1, orient='index').reset_index()
-    df2 = pd.DataFrame.from_dict(env2, orient='index').reset_index()
-    
-    # Rename columns
-    df1.columns = ['pkg_name', 'pkg_version', 'pkg_build', 'channel']
-    df2.columns = ['pkg_name', 'pkg_version', 'pkg_build', 'channel']
-    
-    # Create multi-index columns
-    top_level = ['Package'] + [env1_name] * 3 + [env2_name] * 3
-    bottom_level = ['Name', 'Version', 'Build', 'Channel', 'Version', 'Build', 'Channel']
-    column_index = pd.MultiIndex.from_arrays([top_level, bottom_level])
-    
-    # Merge dataframes
-    merged_df = df1.merge(df2, on='pkg_name', how='outer', 
-                         suffixes=(f'_{env1_name}', f'_{env2_name}'))
-    merged_df = merged_df.sort_values('pkg_name')
-    
-    # Create three views
-    same_versions = merged_df[
-        (merged_df[f'pkg_version_{env1_name}'] == merged_df[f'pkg_version_{env2_name}']) &
-        (merged_df[f'pkg_build_{env1_name}'] == merged_df[f'pkg_build_{env2_name}']) &
-        (merged_df[f'channel_{env1_name}'] == merged_df[f'channel_{env2_name}'])
-    ].copy()
-    
-    diff_versions = merged_df[
-        (merged_df[f'pkg_version_{env1_name}'].notna()) & 
-        (merged_df[f'pkg_version_{env2_name}'].notna()) &
-        ((merged_df[f'pkg_version_{env1_name}'] != merged_df[f'pkg_version_{env2_name}']) |
-         (merged_df[f'pkg_build_{env1_name}'] != merged_df[f'pkg_build_{env2_name}']) |
-         (merged_df[f'channel_{env1_name}'] != merged_df[f'channel_{env2_name}']))
-    ].copy()
-    
-    unique_pkgs = merged_df[
-        merged_df[f'pkg_version_{env1_name}'].isna() | 
-        merged_df[f'pkg_version_{env2_name}'].isna()
-    ].copy()
-    
-    # Process each DataFrame
+    return split_comparison(compare_environments(snapshots))
+
+def partition_masks(comparison):
+    """Return a boolean row mask per status of a compare_environments result."""
+    status = comparison[('Package', 'Status')].to_numpy()
+    return {status_value: status == status_value for status_value in STATUSES}
+
+def split_comparison(comparison):
+    """Split the output of compare_environments into the SAME / DIFFERENT / UNIQUE tables.
+    
+    Returns the packages that are identical in all environments, those
+    present everywhere with differing versions/builds/channels, and those
+    missing from at least one environment. Only the DIFFERENT table keeps
+    the Direction columns; they carry no information in the other two.
+    Each table is selected with a single row mask and column list, so only
+    the (small) categorical codes of its rows are copied. Missing values
+    stay NaN; the text report prints them as '~'.
+    """
+    masks = partition_masks(comparison)
+    columns = [col for col in comparison.columns if col != ('Package', 'Status')]
+    plain_columns = [col for col in columns if col[1] != 'Direction']
+    
     dataframes = []
-    for df in [same_versions, diff_versions, unique_pkgs]:
-        df.fillna('~', inplace=True)
-        
-        # Create the new DataFrame with proper structure
-        new_data = {
-            ('Package', 'Name'): df['pkg_name'],
-            (env1_name, 'Version'): df[f'pkg_version_{env1_name}'],
-            (env1_name, 'Build'): df[f'pkg_build_{env1_name}'],
-            (env1_name, 'Channel'): df[f'channel_{env1_name}'],
-            (env2_name, 'Version'): df[f'pkg_version_{env2_name}'],
-            (env2_name, 'Build'): df[f'pkg_build_{env2_name}'],
-            (env2_name, 'Channel'): df[f'channel_{env2_name}']
-        }
-        
-        # Create DataFrame with multi-index columns
-        df_reshaped = pd.DataFrame(new_data)
-        df_reshaped.columns = column_index
-        dataframes.append(df_reshaped)
+    for status_value in (STATUS_IDENTICAL, STATUS_DIVERGENT, STATUS_PARTIAL):
+        selected = columns if status_value == STATUS_DIVERGENT else plain_columns
+        dataframes.append(comparison.loc[masks[status_value], selected])
     
     return dataframes[0], dataframes[1], dataframes[2]
 
-def save_comparison_to_file(filename, env1_name, env2_name, env1_stats, env2_stats, 
-                          same_vers, diff_vers, unique_pkgs):
-    """Save comparison results to file."""
+def get_section_titles(env_count):
+    """Return the headings of the SAME, DIFFERENT and UNIQUE package tables."""
+    if env_count == 2:
+        return ("Packages in Both Environments with SAME versions:",
+                "Packages in Both Environments with DIFFERENT versions:",
+                "Packages in only ONE environment (and NOT the other):")
+    return (f"Packages in ALL {env_count} Environments with SAME versions:",
+            f"Packages in ALL {env_count} Environments with DIFFERENT versions:",
+            "Packages in only SOME environments (and NOT the others):")
+
+def create_package_records(comparison, env_names):
+    """Reshape the wide comparison into the long package table of the columnar formats.
+    
+    One row per (package, environment), including environments the package
+    is missing from, so the schema does not depend on how many
+    environments were compared or what they are called.
+    """
+    import pandas as pd
+    
+    sections = comparison[('Package', 'Status')].map(SECTION_NAMES).to_numpy()
+    names = comparison[('Package', 'Name')].to_numpy()
+    frames = []
+    for i, env_name in enumerate(env_names):
+        frames.append(pd.DataFrame({
+            'section': sections,
+            'package': names,
+            'environment': env_name,
+            'env_index': i,
+            'version': comparison[(env_name, 'Version')].to_numpy(),
+            'build': comparison[(env_name, 'Build')].to_numpy(),
+            'channel': comparison[(env_name, 'Channel')].to_numpy(),
+            'direction': comparison[(env_name, 'Direction')].to_numpy() if i else None,
+        }))
+    records = pd.concat(frames, ignore_index=True)
+    return records.where(records.notna(), None)
+
+def create_statistics_records(snapshots):
+    """Return the environment statistics table with the columnar-format schema."""
+    import pandas as pd
+    
+    stats = create_statistics_dataframe(snapshots)
+    records = pd.DataFrame({
+        'environment': stats['Environment'],
+        'env_index': range(len(stats)),
+        'date_first_created': stats['Date_First_Created'],
+        'current_packages_count': pd.to_numeric(stats['Current_Packages_Count'], errors='coerce'),
+        'revision_count': pd.to_numeric(stats['Revision_Count'], errors='coerce'),
+        'latest_revision_date': stats['Latest_Revision_Date'],
+    })
+    records[['date_first_created', 'latest_revision_date']] = \
+        records[['date_first_created', 'latest_revision_date']].replace('Unknown', None)
+    return records.astype({'current_packages_count': 'Int64', 'revision_count': 'Int64'})
+
+def get_arrow_schemas():
+    """Return the (packages, statistics) pyarrow schemas of the Parquet / Arrow outputs."""
+    import pyarrow as pa
+    
+    metadata = {'schema_version': str(REPORT_SCHEMA_VERSION)}
+    common = [('comparison_id', pa.string()), ('generated_at', pa.string())]
+    packages = pa.schema(common + [
+        ('section', pa.string()), ('package', pa.string()), ('environment', pa.string()),
+        ('env_index', pa.int32()), ('version', pa.string()), ('build', pa.string()),
+        ('channel', pa.string()), ('direction', pa.string()),
+    ], metadata=metadata)
+    statistics = pa.schema(common + [
+        ('environment', pa.string()), ('env_index', pa.int32()),
+        ('date_first_created', pa.string()), ('current_packages_count', pa.int64()),
+        ('revision_count', pa.int64()), ('latest_revision_date', pa.string()),
+    ], metadata=metadata)
+    return packages, statistics
+
+def save_comparison_records(basename, output_format, snapshots, comparison):
+    """Write the package and statistics tables as jsonl, parquet or arrow files.
+    
+    Every row carries the comparison_id (the report basename) and the
+    generation time, so historical outputs can simply be concatenated.
+    Returns the names of the files written.
+    """
+    generated_at = datetime.now().isoformat(timespec='seconds')
+    tables = {
+        'packages': create_package_records(comparison, [snapshot.name for snapshot in snapshots]),
+        'stats': create_statistics_records(snapshots),
+    }
+    for table in tables.values():
+        table.insert(0, 'generated_at', generated_at)
+        table.insert(0, 'comparison_id', os.path.basename(basename))
+    
+    filenames = {name: f'{basename}_{name}.{output_format}' for name in tables}
+    if output_format == 'jsonl':
+        for name, table in tables.items():
+            table.to_json(filenames[name], orient='records', lines=True)
+        return list(filenames.values())
+    
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schemas = dict(zip(tables, get_arrow_schemas()))
+    for name, table in tables.items():
+        arrow_table = pa.Table.from_pandas(table, schema=schemas[name], preserve_index=False)
+        arrow_table = arrow_table.replace_schema_metadata(schemas[name].metadata)
+        if output_format == 'parquet':
+            pq.write_table(arrow_table, filenames[name])
+        else:
+            with pa.OSFile(filenames[name], 'wb') as sink, pa.ipc.new_file(sink, arrow_table.schema) as writer:
+                writer.write_table(arrow_table)
+    return list(filenames.values())
+
+def iter_report_chunks(snapshots, same_vers, diff_vers, unique_pkgs):
+    """Yield the text report piece by piece, rendering every table exactly once.
+    
+    The SAME table is rendered first because its header sets the report
+    width; every other table is rendered only when its section is reached,
+    so at most two rendered tables are held in memory at a time.
+    """
+    same_text = same_vers.to_string(index=False, na_rep='~')
+    
     # Calculate maximum width based on content
-    max_width = max(120, len(same_vers.to_string(index=False).split('\n')[0]))
+    max_width = max(120, len(same_text.split('\n', 1)[0]))
     separator = "=" * max_width
     table_line = "-" * max_width
+    same_title, diff_title, unique_title = get_section_titles(len(snapshots))
     
-    with open(filename, 'w') as file:
-        # Environment Statistics table
-        file.write(f"{separator}\n")
-        file.write("Environment Comparison Statistics:\n")
-        file.write(f"{table_line}\n")
-        
-        # Create statistics DataFrame
-        stats_data = {
-            'Environment': [env1_name, env2_name],
-            'Date_First_Created': [env1_stats['Date_First_Created'], env2_stats['Date_First_Created']],
-            'Current_Packages_Count': [env1_stats['Current_Packages_Count'], env2_stats['Current_Packages_Count']],
-            'Revision_Count': [env1_stats['Revision_Count'], env2_stats['Revision_Count']],
-            'Latest_Revision_Date': [env1_stats['Latest_Revision_Date'], env2_stats['Latest_Revision_Date']]
-        }
-        stats_df = pd.DataFrame(stats_data)
-        file.write(stats_df.to_string(index=False))
-        file.write(f"\n{table_line}\n")
-        file.write(f"{separator}\n\n")
-        
-        # Same versions table
-        file.write(f"{separator}\n")
-        file.write("Packages in Both Environments with SAME versions:\n")
-        file.write(f"{table_line}\n")
-        file.write(same_vers.to_string(index=False))
-        file.write(f"\n{table_line}\n")
-        file.write(f"{separator}\n\n")
-        
-        # Different versions table
-        file.write(f"{separator}\n")
-        file.write("Packages in Both Environments with DIFFERENT versions:\n")
-        file.write(f"{table_line}\n")
-        file.write(diff_vers.to_string(index=False))
-        file.write(f"\n{table_line}\n")
-        file.write(f"{separator}\n\n")
-        
-        # Unique packages table
-        file.write(f"{separator}\n")
-        file.write("Packages in only ONE environment (and NOT the other):\n")
-        file.write(f"{table_line}\n")
-        file.write(unique_pkgs.to_string(index=False))
-        file.write(f"\n{table_line}\n")
-        file.write(f"{separator}\n")
+    sections = [
+        ("Environment Comparison Statistics:", lambda: create_statistics_dataframe(snapshots).to_string(index=False)),
+        (same_title, lambda: same_text),
+        (diff_title, lambda: diff_vers.to_string(index=False, na_rep='~')),
+        (unique_title, lambda: unique_pkgs.to_string(index=False, na_rep='~')),
+    ]
+    for i, (title, render) in enumerate(sections):
+        yield f"{separator}\n{title}\n{table_line}\n"
+        with span('render'):
+            text = render()
+        yield text
+        yield f"\n{table_line}\n{separator}\n" + ("\n" if i < len(sections) - 1 else "")
 
-def main():
-    """Main function to run the comparison."""
+def open_report_file(filename):
+    """Open a report file for writing, gzip-compressed if the name ends in .gz."""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wt', encoding='utf-8')
+    return open(filename, 'w')
+
+def write_report(chunks, sinks):
+    """Stream report chunks to every sink (any object with a write method)."""
+    for chunk in chunks:
+        with span('write'):
+            for sink in sinks:
+                sink.write(chunk)
+
+def save_comparison_to_file(filename, snapshots, same_vers, diff_vers, unique_pkgs):
+    """Save comparison results to file."""
+    with open_report_file(filename) as file:
+        write_report(iter_report_chunks(snapshots, same_vers, diff_vers, unique_pkgs), [file])
+
+def describe_record(info):
+    """Short version/build/channel description of one package record ('~' if missing)."""
+    if info is None:
+        return '~'
+    details = ', '.join(part for part in (info['build'], info['channel']) if part)
+    return f"{info['version']} ({details})" if details else info['version']
+
+def run_check(snapshots, packages=None):
+    """Print the packages that differ between the snapshots and return the exit status.
+    
+    Works on plain dicts only (diff_snapshots), so no pandas is imported.
+    """
+    diff = diff_snapshots(snapshots, packages)
+    for status in (STATUS_DIVERGENT, STATUS_PARTIAL):
+        for name in diff[status]:
+            records = ' | '.join(describe_record(snapshot.packages.get(name)) for snapshot in snapshots)
+            print(f"{SECTION_NAMES[status].upper():<9} {name}: {records}")
+    if packages is not None:
+        missing = sorted(set(packages).difference(*diff.values()))
+        if missing:
+            print(f"Warning: not installed in any environment: {', '.join(missing)}")
+    status = diff_exit_status(diff)
+    if status == EXIT_IDENTICAL:
+        print(f"Identical: {len(diff[STATUS_IDENTICAL])} packages checked.")
+    else:
+        print(f"Differences found: {len(diff[STATUS_DIVERGENT])} different, {len(diff[STATUS_PARTIAL])} unique, "
+              f"{len(diff[STATUS_IDENTICAL])} same.")
+    return status
+
+def describe_change(name, old, new):
+    """Describe how one package record changed, e.g. 'numpy 1.26.4 -> 2.0.1'."""
+    if old is None:
+        return f"{name} {new['version']} installed"
+    if new is None:
+        return f"{name} {old['version']} removed"
+    if old['version'] != new['version']:
+        return f"{name} {old['version']} -> {new['version']}"
+    return f"{name} {describe_record(old)} -> {describe_record(new)}"
+
+def format_section_counts(statuses):
+    """One-line count of packages per report section."""
+    counts = {status: 0 for status in STATUSES}
+    for status in statuses.values():
+        counts[status] += 1
+    return ", ".join(f"{SECTION_NAMES[status]}={counts[status]}" for status in STATUSES)
+
+def watch_environments(env_names, interval):
+    """Poll the environments' conda-meta folders and print every change as a delta.
+    
+    Only the package records that were added, removed or rewritten are
+    re-read (CondaMetaWatcher), and only the affected packages are
+    re-classified, so each update costs milliseconds regardless of the
+    environment size. Runs until interrupted with Ctrl+C.
+    """
+    prefixes = [find_env_prefix(env_name) for env_name in env_names]
+    missing = [env_name for env_name, prefix in zip(env_names, prefixes) if prefix is None]
+    if missing:
+        print(f"Error: --watch needs a local conda-meta folder; not found for: {', '.join(missing)}")
+        return 1
+    watchers = [CondaMetaWatcher(prefix) for prefix in prefixes]
+    names = set().union(*(watcher.packages for watcher in watchers))
+    statuses = {name: classify_records([watcher.packages.get(name) for watcher in watchers]) for name in names}
+    print(f"Watching {len(env_names)} environments ({format_section_counts(statuses)}). Press Ctrl+C to stop.")
+    
+    try:
+        while True:
+            time.sleep(interval)
+            started = time.perf_counter()
+            changes = [(env_name, name, old, new)
+                       for env_name, watcher in zip(env_names, watchers)
+                       for name, (old, new) in sorted(watcher.poll().items())]
+            if not changes:
+                continue
+            stamp = datetime.now().strftime('%H:%M:%S')
+            for env_name, name, old, new in changes:
+                records = [watcher.packages.get(name) for watcher in watchers]
+                previous = statuses.pop(name, None)
+                if all(record is None for record in records):
+                    print(f"[{stamp}] {env_name}: {describe_change(name, old, new)}, now in no environment")
+                    continue
+                status = statuses[name] = classify_records(records)
+                state = 'still' if status == previous else 'now'
+                print(f"[{stamp}] {env_name}: {describe_change(name, old, new)} {state} {SECTION_NAMES[status].upper()}")
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"[{stamp}] {format_section_counts(statuses)} (updated in {elapsed:.0f} ms)")
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    return 0
+
+def run_comparison(args):
+    """Collect, compare and report as requested on the command line; return the exit status."""
+    if args.watch:
+        return watch_environments(args.envs, args.interval)
+    
+    # Snapshot the live environments concurrently; 'env@revN' ones are replayed from their history,
+    # 'store:<ref>' ones are loaded from the snapshot store and exported files are parsed offline
+    stored = [env for env in args.envs if env.startswith(STORE_PREFIX)]
+    exported = [env for env in args.envs if env not in stored and is_export_file(env)]
+    past = [env for env in args.envs if env not in stored and env not in exported
+            and parse_revision_spec(env)[1] is not None]
+    live = [env for env in args.envs if env not in stored and env not in exported and env not in past]
     try:
-        env1 = sys.argv[1]
-        env2 = sys.argv[2]
-    except IndexError:
-        print("You need to pass the name of two environments at the command line")
-        sys.exit(1)
-
-    # Get environment package lists and statistics
-    e1 = get_env_list(env1)
-    e2 = get_env_list(env2)
-    env1_stats = get_env_statistics(env1)
-    env2_stats = get_env_statistics(env2)
-    
-    # Set pandas display options
+        with span('collect'):
+            snapshots = collect_snapshots(live, max_workers=args.jobs, timeout=args.timeout,
+                                          cache=None if args.no_cache else SnapshotCache(),
+                                          refresh=args.refresh) if live else {}
+            snapshots.update(collect_revision_snapshots(past))
+            snapshots.update(collect_export_snapshots(exported))
+            if stored:
+                from conda_compare_store import load_stored_snapshots  # sqlite3 only when needed
+                snapshots.update(load_stored_snapshots(stored, args.store))
+    except ProbeError as e:
+        print(f"Error: Could not collect environment data:\n{str(e)}")
+        return EXIT_ERROR if args.check else 1
+    snapshots = [snapshots[env] for env in args.envs]
+    
+    if args.save:
+        with span('save'):
+            from conda_compare_store import save_snapshots
+            saved = save_snapshots([snapshot for snapshot in snapshots if snapshot.name not in stored], args.store)
+        for env_name, snapshot_id in saved.items():
+            print(f"Saved snapshot {snapshot_id} of {env_name} in {args.store}")
+    if exported:
+        snapshots = drop_unknown_channels(snapshots)
+    
+    if args.check:
+        with span('check'):
+            return run_check(snapshots, args.package)
+    
+    # Set pandas display options (pandas is only needed from here on)
+    with span('import pandas'):
+        import pandas as pd
+    
     pd.set_option('display.max_columns', None)
     pd.set_option('display.width', None)
     pd.set_option('display.multi_sparse', True)
     pd.set_option('display.unicode.ambiguous_as_wide', True)
     pd.set_option('display.unicode.east_asian_width', True)
     
-    # Create and display DataFrame comparisons
-    same_vers, diff_vers, unique_pkgs = create_comparison_dataframes(env1, e1, env2, e2)
-    
-    # Calculate consistent width for all tables
-    max_width = max(120, len(same_vers.to_string(index=False).split('\n')[0]))
-    separator = "=" * max_width
-    table_line = "-" * max_width
-    
-    # Display Environment Statistics
-    print(f"\n{separator}")
-    print("Environment Comparison Statistics:")
-    print(table_line)
-    stats_data = {
-        'Environment': [env1, env2],
-        'Date_First_Created': [env1_stats['Date_First_Created'], env2_stats['Date_First_Created']],
-        'Current_Packages_Count': [env1_stats['Current_Packages_Count'], env2_stats['Current_Packages_Count']],
-        'Revision_Count': [env1_stats['Revision_Count'], env2_stats['Revision_Count']],
-        'Latest_Revision_Date': [env1_stats['Latest_Revision_Date'], env2_stats['Latest_Revision_Date']]
-    }
-    stats_df = pd.DataFrame(stats_data)
-    print(stats_df.to_string(index=False))
-    print(table_line)
-    print(f"{separator}\n")
-    
-    # Display package comparison results
-    print(f"{separator}")
-    print("Packages in Both Environments with SAME versions:")
-    print(table_line)
-    print(same_vers.to_string(index=False))
-    print(table_line)
-    print(f"{separator}\n")
-    
-    print(f"{separator}")
-    print("Packages in Both Environments with DIFFERENT versions:")
-    print(table_line)
-    print(diff_vers.to_string(index=False))
-    print(table_line)
-    print(f"{separator}\n")
-    
-    print(f"{separator}")
-    print("Packages in only ONE environment (and NOT the other):")
-    print(table_line)
-    print(unique_pkgs.to_string(index=False))
-    print(table_line)
-    print(separator)
+    # Create DataFrame comparisons
+    with span('compare'):
+        comparison = compare_environments(snapshots)
     
     # Generate filename with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f'conda_compare_envs_{env1}_{env2}_{timestamp}.txt'
+    labels = [re.sub(r'[^\w.@-]+', '_', os.path.basename(os.path.normpath(env))) for env in args.envs]
+    if len(labels) > 3:
+        labels = [labels[0], f'and_{len(labels) - 1}_others']
+    basename = f'conda_compare_envs_{"_".join(labels)}_{timestamp}'
     
-    # Save results
-    save_comparison_to_file(filename, env1, env2, env1_stats, env2_stats, 
-                          same_vers, diff_vers, unique_pkgs)
+    if args.format != 'txt':
+        with span(f'write {args.format}'):
+            if args.format == 'html':
+                from conda_compare_html import save_html_report
+                filenames = [f'{basename}.html']
+                save_html_report(filenames[0], snapshots, comparison)
+            else:
+                filenames = save_comparison_records(basename, args.format, snapshots, comparison)
+        counts = comparison[('Package', 'Status')].map(SECTION_NAMES).value_counts()
+        print("\nPackages per section: " +
+              ", ".join(f"{section}={counts.get(section, 0)}" for section in SECTION_NAMES.values()))
+        for filename in filenames:
+            print(f"File: {filename} created.")
+        print("\nDone.")
+        return 0
+    
+    with span('split'):
+        same_vers, diff_vers, unique_pkgs = split_comparison(comparison)
+    filename = f'{basename}.txt'
+    if args.gzip:
+        filename += '.gz'
+    
+    # Render the report once and stream it to the console and the file
+    print()
+    with open_report_file(filename) as file:
+        write_report(iter_report_chunks(snapshots, same_vers, diff_vers, unique_pkgs), [sys.stdout, file])
     print(f"\nFile: {filename} created.")
     print("\nDone.")
-    sys.exit(0)
+    return 0
+
+def save_profile(profiler, filename):
+    """Write cProfile stats to filename and print the most expensive functions."""
+    import pstats
+    
+    profiler.dump_stats(filename)
+    print("\nProfile (top 20 functions by cumulative time):")
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+    print(f"File: {filename} created.")
+
+def main():
+    """Main function to run the comparison."""
+    parser = argparse.ArgumentParser(description="Compare the packages of two or more conda environments.")
+    parser.add_argument('envs', nargs='+', metavar='env',
+                        help="names or prefix paths of the environments to compare; append @revN "
+                             "(e.g. myenv@rev12) to compare the state after revision N of its "
+                             "conda-meta/history (conda packages only); use store:<ref> for a snapshot "
+                             "saved in the snapshot store (see conda_compare_store.py); a file path is "
+                             "read as an exported environment (environment.yml, conda list --export, "
+                             "--explicit or --json output, format auto-detected) without running conda")
+    parser.add_argument('--jobs', type=int, default=MAX_WORKERS,
+                        help=f"maximum number of concurrent probes (default: {MAX_WORKERS})")
+    parser.add_argument('--timeout', type=float, default=CONDA_TIMEOUT,
+                        help=f"timeout in seconds for each conda command (default: {CONDA_TIMEOUT})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f"do not read or write the snapshot cache in {CACHE_DIR}")
+    parser.add_argument('--refresh', action='store_true',
+                        help="ignore cached snapshots but store freshly collected ones")
+    parser.add_argument('--gzip', action='store_true',
+                        help="write the text report file gzip-compressed (.txt.gz); --format txt only")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='txt',
+                        help="output format: fixed-width text report (default), self-contained "
+                             "HTML report, or columnar package/statistics tables; the other formats "
+                             "are written instead of the text report, which is not printed either")
+    parser.add_argument('--check', action='store_true',
+                        help="only check whether the environments differ: print the differing packages "
+                             "and exit with 0 (identical), 1 (different) or 2 (error); no report is written")
+    parser.add_argument('--package', action='append', metavar='NAME',
+                        help="with --check, only check this package (can be repeated)")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and print a delta whenever a package is installed, removed "
+                             "or changed in one of the environments (needs local prefixes)")
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL,
+                        help=f"seconds between two polls in --watch mode (default: {WATCH_INTERVAL})")
+    parser.add_argument('--save', action='store_true',
+                        help="also capture the compared environments in the snapshot store")
+    parser.add_argument('--store', default=STORE_PATH,
+                        help=f"snapshot store used by --save and store:<ref> (default: {STORE_PATH})")
+    parser.add_argument('--timings', action='store_true',
+                        help="print wall time, CPU time, subprocess count and peak memory of every stage")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write the stage spans to FILE in Chrome trace-event format (chrome://tracing)")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="run under cProfile, write the per-function stats to FILE (pstats format) "
+                             "and print the most expensive functions")
+    args = parser.parse_args()
+    if len(args.envs) < 2:
+        parser.error("You need to pass the names of at least two environments")
+    duplicates = sorted({env for env in args.envs if args.envs.count(env) > 1})
+    if duplicates:
+        parser.error(f"Each environment can only be passed once: {', '.join(duplicates)}")
+    if args.package and not args.check:
+        parser.error("--package can only be used with --check")
+    if args.watch and args.check:
+        parser.error("--watch and --check cannot be combined")
+    if args.gzip and args.format != 'txt':
+        parser.error("--gzip only applies to the text report (--format txt)")
+    if args.format in ('parquet', 'arrow'):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error(f"--format {args.format} requires the pyarrow package")
+    
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        status = run_comparison(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            save_profile(profiler, args.profile)
+        if args.timings:
+            print("\nTimings:")
+            print(SPANS.format_summary())
+        if args.trace:
+            SPANS.write_trace(args.trace)
+            print(f"File: {args.trace} created.")
+    sys.exit(status)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,212 @@
+"""
+File: conda_compare_html.py
+
+Self-contained HTML report for conda_compare_envs_final.py (--format html).
+
+The comparison is shipped once as compact JSON: every distinct cell value is
+stored a single time in a string table and each column is a list of integer
+indices into it. Rows are rendered client-side, only for the part of the
+table that is scrolled into view, and highlighted from the precomputed
+section and Direction columns. Page weight therefore grows with the number
+of distinct values plus a few bytes per cell, instead of rows x inline CSS
+as with fully embedded Styler / iTables output.
+"""
+
+import json
+import html
+from datetime import datetime
+
+import pandas as pd
+
+from conda_compare_core import COMPARISON_FIELDS
+from conda_compare_envs_final import SECTION_NAMES, create_statistics_dataframe
+from conda_compare_styling import CLASS_PREFIX, MIRRORED_CLASSES, REFERENCE_CLASSES, STYLESHEET
+
+def encode_comparison(comparison, env_names):
+    """Encode the wide comparison as a string table plus integer-index columns."""
+    strings = []
+    string_ids = {}
+
+    def encode(values):
+        codes = []
+        for value in values:
+            if value is None or (isinstance(value, float) and pd.isna(value)):
+                codes.append(-1)
+            else:
+                codes.append(string_ids.setdefault(value, len(strings)))
+                if codes[-1] == len(strings):
+                    strings.append(value)
+        return codes
+
+    columns = [{'env': None, 'field': 'Name',
+                'values': encode(comparison[('Package', 'Name')])}]
+    for i, env_name in enumerate(env_names):
+        fields = COMPARISON_FIELDS + (('Direction',) if i else ())
+        for field_name in fields:
+            columns.append({'env': i, 'field': field_name,
+                            'values': encode(comparison[(env_name, field_name)])})
+    sections = list(SECTION_NAMES.values())
+    section_codes = comparison[('Package', 'Status')].map(SECTION_NAMES).map(sections.index)
+    return {
+        'envs': list(env_names),
+        'sections': sections,
+        'section': section_codes.tolist(),
+        'strings': strings,
+        'columns': columns,
+    }
+
+def render_statistics_table(snapshots):
+    """Render the (small) environment statistics table as static HTML."""
+    stats = create_statistics_dataframe(snapshots)
+    head = ''.join(f'<th>{html.escape(str(col))}</th>' for col in stats.columns)
+    body = ''.join(
+        '<tr>' + ''.join(f'<td>{html.escape(str(value))}</td>' for value in row) + '</tr>'
+        for row in stats.itertuples(index=False)
+    )
+    return f'<table class="stats"><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>'
+
+def save_html_report(filename, snapshots, comparison):
+    """Write the comparison as a single self-contained HTML file."""
+    env_names = [snapshot.name for snapshot in snapshots]
+    data = json.dumps(encode_comparison(comparison, env_names), separators=(',', ':'))
+    page = HTML_TEMPLATE.format(
+        title=html.escape(' vs '.join(env_names)),
+        generated=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        stats_table=render_statistics_table(snapshots),
+        stylesheet=STYLESHEET,
+        class_prefix=CLASS_PREFIX,
+        reference_classes=json.dumps(REFERENCE_CLASSES),
+        mirrored_classes=json.dumps(MIRRORED_CLASSES),
+        data=data.replace('</', '<\\/'),
+    )
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(page)
+
+HTML_TEMPLATE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Conda environment comparison: {title}</title>
+<style>
+body {{ font-family: system-ui, sans-serif; margin: 1.5em; color: #222; }}
+table.stats {{ border-collapse: collapse; margin-bottom: 1.5em; }}
+table.stats th, table.stats td {{ border: 1px solid #ccc; padding: 4px 10px; text-align: center; }}
+.controls {{ margin-bottom: .6em; display: flex; gap: .4em; align-items: center; }}
+.controls button {{ padding: 4px 10px; border: 1px solid #999; background: #f4f4f4; cursor: pointer; }}
+.controls button.active {{ background: #333; color: #fff; }}
+.controls input {{ margin-left: 1em; padding: 4px 8px; width: 20em; }}
+#viewport {{ height: 70vh; overflow: auto; border: 1px solid #ccc; position: relative; }}
+.row {{ display: grid; height: 24px; line-height: 24px; white-space: nowrap; }}
+.row > div {{ overflow: hidden; text-overflow: ellipsis; padding: 0 6px; text-align: center; }}
+.head {{ position: sticky; top: 0; background: #eee; font-weight: 600; z-index: 1; height: auto; }}
+.head > div {{ line-height: 1.3; padding: 3px 6px; }}
+#rows {{ position: absolute; left: 0; right: 0; }}
+{stylesheet}
+</style>
+</head>
+<body>
+<h1>Conda environment comparison</h1>
+<p>{title} &mdash; generated {generated}</p>
+{stats_table}
+<div class="controls" id="controls"></div>
+<div id="viewport"><div class="row head" id="head"></div><div id="spacer"><div id="rows"></div></div></div>
+<script id="data" type="application/json">{data}</script>
+<script>
+(function () {{
+  var ROW_HEIGHT = 24, BUFFER = 20, PREFIX = '{class_prefix}';
+  var data = JSON.parse(document.getElementById('data').textContent);
+  var S = data.strings, cols = data.columns, nRows = data.section.length;
+  var labels = {{same: 'SAME versions', different: 'DIFFERENT versions', unique: 'Missing from some environments'}};
+  var directionCol = {{}};
+  cols.forEach(function (c, i) {{ if (c.field === 'Direction') directionCol[c.env] = i; }});
+  // Same Version cell classes as the notebook tables (conda_compare_styling)
+  var referenceClasses = {reference_classes}, mirroredClasses = {mirrored_classes};
+
+  var referenceCol = {{}};
+  cols.forEach(function (c, i) {{ if (c.env === 0) referenceCol[c.field] = i; }});
+
+  function cellClass(c, r, section) {{
+    var col = cols[c], v = col.values[r];
+    if (section === 'unique') return PREFIX + (v < 0 ? 'missing' : 'present');
+    if (col.field === 'Version') {{
+      if (col.env > 0) return mirroredClasses[S[cols[directionCol[col.env]].values[r]]] || '';
+      // The reference column takes the second environment's direction in a two-way comparison
+      return data.envs.length === 2 ? (referenceClasses[S[cols[directionCol[1]].values[r]]] || '') : '';
+    }}
+    if ((col.field === 'Build' || col.field === 'Channel') && col.env > 0 && section === 'different') {{
+      return v !== cols[referenceCol[col.field]].values[r] ? PREFIX + 'changed' : '';
+    }}
+    return '';
+  }}
+
+  var visible = [], section = 'all', filter = '';
+  var viewport = document.getElementById('viewport'), spacer = document.getElementById('spacer'),
+      rowsEl = document.getElementById('rows'), head = document.getElementById('head');
+  var template = 'repeat(' + cols.length + ', minmax(7em, 1fr))';
+  head.style.gridTemplateColumns = template;
+  head.innerHTML = cols.map(function (c) {{
+    var env = c.env === null ? 'Package' : data.envs[c.env];
+    return '<div>' + escapeHtml(env) + '<br>' + c.field + '</div>';
+  }}).join('');
+
+  function escapeHtml(s) {{
+    return String(s).replace(/[&<>"]/g, function (ch) {{
+      return {{'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}}[ch];
+    }});
+  }}
+  function applyFilter() {{
+    visible = [];
+    var needle = filter.toLowerCase(), names = cols[0].values;
+    for (var r = 0; r < nRows; r++) {{
+      if (section !== 'all' && data.sections[data.section[r]] !== section) continue;
+      if (needle && S[names[r]].toLowerCase().indexOf(needle) < 0) continue;
+      visible.push(r);
+    }}
+    spacer.style.height = (visible.length * ROW_HEIGHT) + 'px';
+    render();
+  }}
+  function render() {{
+    var first = Math.max(0, Math.floor(viewport.scrollTop / ROW_HEIGHT) - BUFFER);
+    var last = Math.min(visible.length, first + Math.ceil(viewport.clientHeight / ROW_HEIGHT) + 2 * BUFFER);
+    var out = [];
+    for (var i = first; i < last; i++) {{
+      var r = visible[i], rowSection = data.sections[data.section[r]];
+      out.push('<div class="row" style="grid-template-columns:' + template + '">');
+      for (var c = 0; c < cols.length; c++) {{
+        var v = cols[c].values[r];
+        var cls = cellClass(c, r, rowSection);
+        out.push('<div class="' + cls + '">' + (v < 0 ? '~' : escapeHtml(S[v])) + '</div>');
+      }}
+      out.push('</div>');
+    }}
+    rowsEl.style.top = (head.offsetHeight + first * ROW_HEIGHT) + 'px';
+    rowsEl.innerHTML = out.join('');
+  }}
+
+  var controls = document.getElementById('controls');
+  var counts = {{all: nRows}};
+  data.section.forEach(function (s) {{ counts[data.sections[s]] = (counts[data.sections[s]] || 0) + 1; }});
+  ['all'].concat(data.sections).forEach(function (name) {{
+    var button = document.createElement('button');
+    button.textContent = (labels[name] || 'All packages') + ' (' + (counts[name] || 0) + ')';
+    if (name === section) button.className = 'active';
+    button.onclick = function () {{
+      section = name;
+      Array.prototype.forEach.call(controls.querySelectorAll('button'), function (b) {{ b.className = ''; }});
+      button.className = 'active';
+      viewport.scrollTop = 0;
+      applyFilter();
+    }};
+    controls.appendChild(button);
+  }});
+  var search = document.createElement('input');
+  search.placeholder = 'Filter packages by name';
+  search.oninput = function () {{ filter = search.value; viewport.scrollTop = 0; applyFilter(); }};
+  controls.appendChild(search);
+  viewport.addEventListener('scroll', function () {{ window.requestAnimationFrame(render); }});
+  applyFilter();
+}})();
+</script>
+</body>
+</html>
+'''
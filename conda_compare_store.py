@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+"""
+File: conda_compare_store.py
+
+Content-addressed store of environment snapshots (default:
+output_reports/conda_snapshots.sqlite).
+
+Instead of keeping one full-text report per comparison, every package record
+(name, version, build, channel) is stored once under its hash, and every
+environment state is stored once as a packed array of record ids under the
+hash of its records. Capturing the same state again, or another environment
+that shares most of its packages, only adds a capture row and the records
+that are new. Any two stored states can be compared again later, without
+conda, by passing them as store:<ref> to conda_compare_envs_final.py:
+
+    python conda_compare_store.py save myenv other_env     # capture environments
+    python conda_compare_store.py list                      # captures, newest first
+    python conda_compare_store.py stats                     # deduplication statistics
+    python conda_compare_envs_final.py store:3f2a9c1b4d5e store:myenv
+
+A ref is a snapshot id (or an unambiguous prefix of at least 4 characters)
+or an environment name, meaning that environment's latest capture.
+conda_compare_envs_final.py --save captures every compared environment.
+"""
+
+import os
+import sys
+import sqlite3
+import hashlib
+import argparse
+from array import array
+from datetime import datetime
+
+from conda_compare_core import (
+    CONDA_TIMEOUT, MAX_WORKERS, STORE_PATH, STORE_PREFIX, EnvSnapshot, ProbeError, SnapshotCache,
+    collect_revision_snapshots, collect_snapshots, parse_revision_spec,
+)
+
+SNAPSHOT_ID_LENGTH = 16  # hex digits of the snapshot hash used as its id
+MIN_REF_LENGTH = 4
+
+STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    build TEXT NOT NULL,
+    channel TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id TEXT PRIMARY KEY,
+    package_count INTEGER NOT NULL,
+    record_ids BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    snapshot_id TEXT NOT NULL REFERENCES snapshots(id),
+    env_name TEXT NOT NULL,
+    prefix TEXT,
+    captured_at TEXT NOT NULL,
+    revision_count TEXT,
+    first_revision_date TEXT,
+    last_revision_date TEXT
+);
+CREATE INDEX IF NOT EXISTS captures_env_name ON captures(env_name, captured_at);
+'''
+
+def record_hash(name, info):
+    """Content hash of one package record."""
+    key = '\0'.join((name, info['version'], info['build'], info['channel']))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def snapshot_hash(record_hashes):
+    """Content id of an environment state: the hash of its sorted record hashes."""
+    return hashlib.sha1('\n'.join(sorted(record_hashes)).encode('ascii')).hexdigest()[:SNAPSHOT_ID_LENGTH]
+
+class SnapshotStore:
+    """SQLite store of deduplicated package records, environment states and captures."""
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(STORE_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def record_ids(self, packages):
+        """Return the record ids of a {name: record} dict, inserting unknown records."""
+        hashes = {record_hash(name, info): (name, info) for name, info in packages.items()}
+        cursor = self.connection.cursor()
+        cursor.executemany(
+            'INSERT OR IGNORE INTO records (hash, name, version, build, channel) VALUES (?, ?, ?, ?, ?)',
+            [(h, name, info['version'], info['build'], info['channel']) for h, (name, info) in hashes.items()])
+        ids = {}
+        hash_list = list(hashes)
+        for i in range(0, len(hash_list), 500):  # stay below SQLite's bound-parameter limit
+            chunk = hash_list[i:i + 500]
+            cursor.execute(f"SELECT hash, id FROM records WHERE hash IN ({','.join('?' * len(chunk))})", chunk)
+            ids.update(cursor.fetchall())
+        return hashes, ids
+
+    def save(self, snapshot):
+        """Store one EnvSnapshot; returns its snapshot id (unchanged states share one id)."""
+        with self.connection:
+            hashes, ids = self.record_ids(snapshot.packages)
+            snapshot_id = snapshot_hash(hashes)
+            record_ids = array('q', sorted(ids[h] for h in hashes))
+            self.connection.execute('INSERT OR IGNORE INTO snapshots (id, package_count, record_ids) VALUES (?, ?, ?)',
+                                    (snapshot_id, len(record_ids), record_ids.tobytes()))
+            self.connection.execute(
+                'INSERT INTO captures (snapshot_id, env_name, prefix, captured_at, revision_count, '
+                'first_revision_date, last_revision_date) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (snapshot_id, snapshot.name, snapshot.prefix, datetime.now().isoformat(timespec='seconds'),
+                 str(snapshot.revision_count), snapshot.first_revision_date, snapshot.last_revision_date))
+        return snapshot_id
+
+    def resolve(self, ref):
+        """Return the (snapshot id, capture row) a ref points to; raise ValueError if none or ambiguous."""
+        cursor = self.connection.cursor()
+        capture_columns = 'snapshot_id, env_name, prefix, captured_at, revision_count, ' \
+                          'first_revision_date, last_revision_date'
+        if len(ref) >= MIN_REF_LENGTH and all(ch in '0123456789abcdef' for ch in ref):
+            matches = [row[0] for row in cursor.execute('SELECT id FROM snapshots WHERE substr(id, 1, ?) = ?',
+                                                        (len(ref), ref))]
+            if len(matches) > 1:
+                raise ValueError(f"snapshot ref '{ref}' is ambiguous ({len(matches)} matches)")
+            if matches:
+                row = cursor.execute(f'SELECT {capture_columns} FROM captures WHERE snapshot_id = ? '
+                                     'ORDER BY captured_at DESC, id DESC LIMIT 1', (matches[0],)).fetchone()
+                return matches[0], row
+        row = cursor.execute(f'SELECT {capture_columns} FROM captures WHERE env_name = ? '
+                             'ORDER BY captured_at DESC, id DESC LIMIT 1', (ref,)).fetchone()
+        if row is None:
+            raise ValueError(f"no stored snapshot or environment matches '{ref}'")
+        return row[0], row
+
+    def load(self, ref, name=None):
+        """Rebuild the EnvSnapshot a ref points to (named name, default the ref)."""
+        snapshot_id, capture = self.resolve(ref)
+        blob = self.connection.execute('SELECT record_ids FROM snapshots WHERE id = ?', (snapshot_id,)).fetchone()[0]
+        record_ids = array('q')
+        record_ids.frombytes(blob)
+        packages = {}
+        ids = list(record_ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for pkg, version, build, channel in self.connection.execute(
+                    f"SELECT name, version, build, channel FROM records WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk):
+                packages[pkg] = {'version': version, 'build': build, 'channel': channel}
+        _, env_name, prefix, captured_at, revision_count, first_date, last_date = capture
+        return EnvSnapshot(name=name or ref, prefix=prefix, packages=dict(sorted(packages.items())),
+                           revision_count=int(revision_count) if revision_count.isdigit() else revision_count,
+                           first_revision_date=first_date, last_revision_date=last_date)
+
+    def captures(self, env_name=None, limit=None):
+        """Return capture rows, newest first."""
+        query = 'SELECT c.id, c.snapshot_id, c.env_name, c.captured_at, s.package_count ' \
+                'FROM captures c JOIN snapshots s ON s.id = c.snapshot_id'
+        params = []
+        if env_name:
+            query += ' WHERE c.env_name = ?'
+            params.append(env_name)
+        query += ' ORDER BY c.captured_at DESC, c.id DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return self.connection.execute(query, params).fetchall()
+
+    def stats(self):
+        """Return record/snapshot/capture counts and the size of the store."""
+        counts = {table: self.connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                  for table in ('records', 'snapshots', 'captures')}
+        counts['stored_rows'] = self.connection.execute('SELECT COALESCE(SUM(package_count), 0) FROM snapshots').fetchone()[0]
+        counts['captured_rows'] = self.connection.execute(
+            'SELECT COALESCE(SUM(s.package_count), 0) FROM captures c JOIN snapshots s ON s.id = c.snapshot_id'
+        ).fetchone()[0]
+        counts['size_bytes'] = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return counts
+
+def load_stored_snapshots(env_specs, store_path=STORE_PATH):
+    """Load the snapshots of 'store:<ref>' specs; failures are raised together as a ProbeError."""
+    if not os.path.exists(store_path):
+        raise ProbeError(f"snapshot store {store_path} does not exist")
+    store = SnapshotStore(store_path)
+    snapshots = {}
+    errors = []
+    try:
+        for env_spec in env_specs:
+            try:
+                snapshots[env_spec] = store.load(env_spec[len(STORE_PREFIX):], name=env_spec)
+            except ValueError as e:
+                errors.append(f"stored snapshot '{env_spec}' failed: {str(e)}")
+    finally:
+        store.close()
+    if errors:
+        raise ProbeError('\n'.join(errors))
+    return snapshots
+
+def save_snapshots(snapshots, store_path=STORE_PATH):
+    """Capture snapshots in the store; returns {name: snapshot id}."""
+    store = SnapshotStore(store_path)
+    try:
+        return {snapshot.name: store.save(snapshot) for snapshot in snapshots}
+    finally:
+        store.close()
+
+def main():
+    """Main function to run the snapshot store commands."""
+    parser = argparse.ArgumentParser(description="Content-addressed store of conda environment snapshots.")
+    parser.add_argument('--store', default=STORE_PATH, help=f"store file (default: {STORE_PATH})")
+    commands = parser.add_subparsers(dest='command', required=True)
+    save = commands.add_parser('save', help="capture environments (names, prefixes or env@revN)")
+    save.add_argument('envs', nargs='+', metavar='env')
+    save.add_argument('--jobs', type=int, default=MAX_WORKERS,
+                      help=f"maximum number of concurrent probes (default: {MAX_WORKERS})")
+    save.add_argument('--timeout', type=float, default=CONDA_TIMEOUT,
+                      help=f"timeout in seconds for each conda command (default: {CONDA_TIMEOUT})")
+    listing = commands.add_parser('list', help="list captures, newest first")
+    listing.add_argument('--env', help="only captures of this environment")
+    listing.add_argument('--limit', type=int, default=50, help="number of captures to show (default: 50)")
+    commands.add_parser('stats', help="show how much the store deduplicates")
+    args = parser.parse_args()
+
+    if args.command == 'save':
+        past = [env for env in args.envs if parse_revision_spec(env)[1] is not None]
+        live = [env for env in args.envs if env not in past]
+        try:
+            snapshots = collect_snapshots(live, max_workers=args.jobs, timeout=args.timeout,
+                                          cache=SnapshotCache()) if live else {}
+            snapshots.update(collect_revision_snapshots(past))
+        except ProbeError as e:
+            print(f"Error: Could not collect environment data:\n{str(e)}")
+            sys.exit(1)
+        ids = save_snapshots([snapshots[env] for env in args.envs], args.store)
+        for env_name, snapshot_id in ids.items():
+            print(f"{snapshot_id}  {env_name}")
+        print(f"\nFile: {args.store} updated.")
+        return
+
+    if not os.path.exists(args.store):
+        print(f"Error: snapshot store {args.store} does not exist")
+        sys.exit(1)
+    store = SnapshotStore(args.store)
+    try:
+        if args.command == 'list':
+            print(f"{'Capture':>7}  {'Snapshot':<{SNAPSHOT_ID_LENGTH}}  {'Captured_At':<19}  {'Packages':>8}  Environment")
+            for capture_id, snapshot_id, env_name, captured_at, package_count in \
+                    store.captures(args.env, args.limit):
+                print(f"{capture_id:>7}  {snapshot_id}  {captured_at:<19}  {package_count:>8}  {env_name}")
+        else:
+            stats = store.stats()
+            print(f"Captures:             {stats['captures']}")
+            print(f"Distinct states:      {stats['snapshots']}")
+            print(f"Distinct records:     {stats['records']}")
+            print(f"Package rows covered: {stats['captured_rows']}")
+            if stats['records']:
+                print(f"Deduplication:        {stats['captured_rows'] / stats['records']:.1f}x")
+            print(f"Store size:           {stats['size_bytes'] / 1024:.1f} KiB")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+File: conda_compare_styling.py
+
+Vectorised styling of package comparison tables (PROD notebook and HTML report).
+
+Instead of `df.style.apply(highlight, axis=1)` with a Python closure per
+row, the whole CSS-class matrix is computed column by column with NumPy
+from the precomputed Direction column (see version_directions in
+conda_compare_envs_final.py). The class matrix is written straight into the
+<td> tags of the table markup (ClassedTable), as conda_compare_html.py does,
+and the colours live in one small shared stylesheet, so neither per-cell CSS
+rules nor a Styler render are needed.
+
+Colour scheme (unchanged from the original notebook styling), named after
+the version in the cell itself:
+- lightgrey:   versions are equal
+- lightpink:   the cell holds the older version
+- lightgreen:  the cell holds the newer version
+- lightyellow: the package is missing from the environment
+- lightblue:   the package is present (UNIQUE table)
+"""
+
+import html
+
+import numpy as np
+import pandas as pd
+
+from conda_compare_core import DIRECTION_EQUAL, DIRECTION_NEWER, DIRECTION_OLDER
+from conda_compare_envs_final import version_directions
+
+CLASS_PREFIX = 'cc-'
+CLASS_COLORS = {
+    'equal': 'lightgrey',
+    'older-version': 'lightpink',
+    'newer-version': 'lightgreen',
+    'missing': 'lightyellow',
+    'present': 'lightblue',
+    'changed': '#fde8c8',
+}
+STYLESHEET = '\n'.join(
+    f'.{CLASS_PREFIX}{name} {{ background-color: {color}; }}' for name, color in CLASS_COLORS.items()
+)
+
+# Class of the env1 Version cell for each direction of env2 relative to env1
+REFERENCE_CLASSES = {
+    DIRECTION_EQUAL: CLASS_PREFIX + 'equal',
+    DIRECTION_NEWER: CLASS_PREFIX + 'older-version',
+    DIRECTION_OLDER: CLASS_PREFIX + 'newer-version',
+}
+# The env2 Version cell gets the mirror colour in the DIFFERENT table
+MIRRORED_CLASSES = {
+    DIRECTION_EQUAL: CLASS_PREFIX + 'equal',
+    DIRECTION_NEWER: CLASS_PREFIX + 'newer-version',
+    DIRECTION_OLDER: CLASS_PREFIX + 'older-version',
+}
+
+def add_direction_column(df, env1_name, env2_name):
+    """Add the (env2, 'Direction') column: env2's version relative to env1's."""
+    df[(env2_name, 'Direction')] = version_directions(df[(env1_name, 'Version')], df[(env2_name, 'Version')])
+    return df
+
+def get_directions(df, env1_name, env2_name):
+    """Return the Direction column, computing it only if the table does not carry one."""
+    if (env2_name, 'Direction') in df.columns:
+        return df[(env2_name, 'Direction')].to_numpy(dtype=object)
+    return version_directions(df[(env1_name, 'Version')], df[(env2_name, 'Version')])
+
+def map_classes(directions, class_map):
+    """Map an array of directions to class names ('' for anything unmapped)."""
+    return pd.Series(directions, dtype=object).map(class_map).fillna('').to_numpy(dtype=object)
+
+def version_class_matrix(df, env1_name, env2_name, mirrored):
+    """Class matrix colouring both Version columns from the Direction column.
+
+    With mirrored=False (SAME table) both Version cells share one colour, as
+    in the original highlight_differences(); with mirrored=True (DIFFERENT
+    table) the env2 cell gets the opposite colour of the env1 cell.
+    """
+    directions = get_directions(df, env1_name, env2_name)
+    reference = map_classes(directions, REFERENCE_CLASSES)
+    if mirrored:
+        other = map_classes(directions, MIRRORED_CLASSES)
+    else:
+        missing = (pd.isna(df[(env1_name, 'Version')]) | pd.isna(df[(env2_name, 'Version')])).to_numpy()
+        reference = other = np.where(missing, CLASS_PREFIX + 'missing', reference)
+
+    classes = pd.DataFrame('', index=df.index, columns=df.columns)
+    classes[(env1_name, 'Version')] = reference
+    classes[(env2_name, 'Version')] = other
+    return classes
+
+def presence_class_matrix(df):
+    """Class matrix marking every cell as missing or present (UNIQUE table)."""
+    values = np.where(pd.isna(df).to_numpy(), CLASS_PREFIX + 'missing', CLASS_PREFIX + 'present')
+    return pd.DataFrame(values, index=df.index, columns=df.columns)
+
+class ClassedTable:
+    """A table whose cells carry CSS classes, rendered straight to HTML markup.
+
+    Displayed like a Styler (display() uses _repr_html_), but the classes are
+    written into the <td> tags directly: Styler.to_html() builds a context
+    dict per cell and runs it through Jinja, which dominates at thousands of
+    rows. Direction columns are hidden and missing values shown as '~'.
+    """
+
+    def __init__(self, df, classes):
+        columns = [col for col in df.columns if not (isinstance(col, tuple) and col[1:] == ('Direction',))]
+        self.data = df[columns]
+        self.classes = classes[columns]
+        # Package names are the index in the notebook; a default RangeIndex is not shown
+        self.show_index = not isinstance(df.index, pd.RangeIndex)
+
+    def header_html(self):
+        """One header row per column level; equal neighbouring labels are merged with colspan."""
+        columns = [col if isinstance(col, tuple) else (col,) for col in self.data.columns]
+        levels = len(columns[0]) if columns else 0
+        index_name = html.escape(str(self.data.index.name or ''))
+        rows = []
+        for level in range(levels):
+            cells = []
+            for col in columns:
+                if cells and level < len(columns[0]) - 1 and cells[-1][0] == col[:level + 1]:
+                    cells[-1][1] += 1
+                else:
+                    cells.append([col[:level + 1], 1])
+            first = f'<th rowspan="{levels}">{index_name}</th>' if self.show_index and not level else ''
+            rows.append('<tr>' + first + ''.join(
+                f'<th colspan="{span}">{html.escape(str(key[-1]))}</th>' if span > 1 else
+                f'<th>{html.escape(str(key[-1]))}</th>' for key, span in cells) + '</tr>')
+        return ''.join(rows)
+
+    def to_html(self):
+        columns = []
+        for col in self.data.columns:
+            values = self.data[col].astype(object)
+            text = [html.escape(str(value)) for value in values.where(values.notna(), '~')]
+            classes = self.classes[col].to_numpy(dtype=object)
+            columns.append([f'<td class="{cls}">{value}</td>' if cls else f'<td>{value}</td>'
+                            for cls, value in zip(classes, text)])
+        if self.show_index:
+            columns.insert(0, [f'<th>{html.escape(str(name))}</th>' for name in self.data.index])
+        body = ''.join('<tr>' + ''.join(row) + '</tr>' for row in zip(*columns))
+        return (f'<style>{STYLESHEET}</style><table><thead>{self.header_html()}</thead>'
+                f'<tbody>{body}</tbody></table>')
+
+    def _repr_html_(self):
+        return self.to_html()
+
+def style_with_classes(df, classes):
+    """Pair a table with its class matrix for rendering with the shared stylesheet."""
+    return ClassedTable(df, classes)
+
+def apply_styling(df, env1_name, env2_name):
+    """Style the SAME versions table."""
+    return style_with_classes(df, version_class_matrix(df, env1_name, env2_name, mirrored=False))
+
+def apply_diff_styling(df, env1_name, env2_name):
+    """Style the DIFFERENT versions table."""
+    return style_with_classes(df, version_class_matrix(df, env1_name, env2_name, mirrored=True))
+
+def apply_unique_styling(df, env1_name, env2_name):
+    """Style the UNIQUE packages table."""
+    return style_with_classes(df, presence_class_matrix(df))
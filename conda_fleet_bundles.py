@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+"""
+File: conda_fleet_bundles.py
+
+Drift report for one "standard" environment deployed on many nodes.
+
+Each node runs the lightweight collector, which packs the environment's
+conda-meta folder (package records and history) into a compressed tarball
+without launching conda:
+
+    python conda_fleet_bundles.py collect /opt/conda/envs/standard --output-dir /shared/bundles
+
+The aggregator then reads hundreds of bundles on a process pool and reports,
+for every package, the nodes whose (version, build, channel) deviates from
+the reference: the majority of the nodes by default, or one node, bundle or
+exported environment file (see conda_compare_core.load_export_file):
+
+    python conda_fleet_bundles.py aggregate /shared/bundles
+    python conda_fleet_bundles.py aggregate /shared/bundles --reference node042 --csv drift.csv
+    python conda_fleet_bundles.py aggregate /shared/bundles --reference standard.lock
+
+The first member of a bundle is bundle.json: the node name, revision
+statistics and the already parsed conda-meta package list. Pip packages
+are not recorded (a plain conda-meta tarball has none either), so they
+are left out of exported reference files too. The aggregator reads only
+that member and stops decompressing there, so its time and memory do not
+depend on the size of the raw conda-meta records that follow it. Plain
+tarballs of a conda-meta folder (e.g. `tar czf node.tar.gz conda-meta`) are
+also accepted; their records are parsed member by member. An extracted
+bundle is a valid prefix for conda_compare_envs_final.py.
+
+The aggregate exit status is 0 when no node deviates, 1 when some do and 2
+when a bundle could not be read or the reference was not found.
+"""
+
+import io
+import os
+import sys
+import csv
+import glob
+import json
+import socket
+import tarfile
+import threading
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from conda_compare_core import (
+    CHANNEL_LESS_FORMATS, EXIT_DIFFERENT, EXIT_ERROR, EXIT_IDENTICAL, detect_export_format, find_env_prefix,
+    load_export_file, parse_history_bytes, parse_package_record, read_conda_meta, read_history_index,
+)
+
+BUNDLE_VERSION = 1
+BUNDLE_MANIFEST = 'bundle.json'
+BUNDLE_SUFFIX = '.conda-meta.tar.gz'
+BUNDLE_PATTERNS = ('*.tar.gz', '*.tgz', '*.tar.xz', '*.tar.bz2', '*.tar')
+MAX_LISTED_NODES = 8  # node names shown per deviation group in the console report
+
+def collect_bundle(env_name, node=None, output_dir='.'):
+    """Pack the conda-meta folder of an environment into <output_dir>/<node>.conda-meta.tar.gz."""
+    prefix = find_env_prefix(env_name)
+    if prefix is None:
+        raise ValueError(f"no local prefix found for '{env_name}'")
+    node = node or socket.gethostname()
+    history_file = os.path.join(prefix, 'conda-meta', 'history')
+    revisions = read_history_index(prefix, cache_dir=None) if os.path.isfile(history_file) else []
+    manifest = {
+        'version': BUNDLE_VERSION,
+        'node': node,
+        'env': env_name,
+        'prefix': prefix,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision_count': len(revisions),
+        'first_revision_date': revisions[0]['date'] if revisions else 'Unknown',
+        'last_revision_date': revisions[-1]['date'] if revisions else 'Unknown',
+        'packages': [[name, info['version'], info['build'], info['channel']]
+                     for name, info in read_conda_meta(prefix, include_pip=False).items()],
+    }
+    data = json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+
+    os.makedirs(output_dir, exist_ok=True)
+    filename = os.path.join(output_dir, f'{node}{BUNDLE_SUFFIX}')
+    tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with tarfile.open(tmp_filename, 'w:gz') as tar:
+        info = tarfile.TarInfo(BUNDLE_MANIFEST)
+        info.size = len(data)
+        info.mtime = int(datetime.now().timestamp())
+        tar.addfile(info, fileobj=io.BytesIO(data))
+        if os.path.isfile(history_file):
+            tar.add(history_file, arcname='conda-meta/history')
+        for record_file in sorted(glob.glob(os.path.join(prefix, 'conda-meta', '*.json'))):
+            tar.add(record_file, arcname=f'conda-meta/{os.path.basename(record_file)}')
+    os.replace(tmp_filename, filename)
+    return filename, len(manifest['packages'])
+
+def bundle_node_name(path):
+    """Default node name of a bundle without a manifest: its file name without the tar suffixes."""
+    name = os.path.basename(path)
+    for suffix in (BUNDLE_SUFFIX, '.tar.gz', '.tgz', '.tar.xz', '.tar.bz2', '.tar'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+def read_bundle(path):
+    """Read one bundle as a dict (node, created, revision statistics, packages as tuples).
+
+    Runs in the aggregator's worker processes, so failures are returned as
+    {'path': path, 'error': message} instead of being raised.
+    """
+    try:
+        packages = {}
+        revisions = []
+        with tarfile.open(path, 'r|*') as tar:
+            for member in tar:
+                if member.name == BUNDLE_MANIFEST:
+                    manifest = json.load(tar.extractfile(member))
+                    manifest['packages'] = {name: (version, build, channel)
+                                            for name, version, build, channel in manifest['packages']}
+                    manifest['path'] = path
+                    return manifest
+                # A plain conda-meta tarball: parse the records and history member by member
+                name = member.name[2:] if member.name.startswith('./') else member.name
+                if not member.isfile() or not name.startswith('conda-meta/'):
+                    continue
+                if name == 'conda-meta/history':
+                    parse_history_bytes(tar.extractfile(member).read() + b'\n', revisions, 0)
+                elif name.endswith('.json'):
+                    pkg, info = parse_package_record(json.load(tar.extractfile(member)))
+                    packages[pkg] = (info['version'], info['build'], info['channel'])
+    except (OSError, ValueError, KeyError, TypeError, tarfile.TarError) as e:
+        return {'path': path, 'error': f"{e.__class__.__name__}: {str(e)}"}
+    if not packages:
+        return {'path': path, 'error': "no bundle.json or conda-meta/*.json records found"}
+    return {
+        'path': path,
+        'node': bundle_node_name(path),
+        'created': '',
+        'revision_count': len(revisions),
+        'first_revision_date': revisions[0]['date'] if revisions else 'Unknown',
+        'last_revision_date': revisions[-1]['date'] if revisions else 'Unknown',
+        'packages': packages,
+    }
+
+def find_bundles(paths):
+    """Expand bundle files, directories (every tarball inside) and glob patterns."""
+    bundles = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in BUNDLE_PATTERNS:
+                bundles.extend(glob.glob(os.path.join(path, pattern)))
+        elif os.path.isfile(path):
+            bundles.append(path)
+        else:
+            bundles.extend(glob.glob(path))
+    return sorted(set(bundles))
+
+def load_bundles(paths, jobs=None):
+    """Read bundles on a process pool; returns ({node: bundle}, [errors]).
+
+    Two bundles of the same node keep the most recently collected one.
+    """
+    nodes = {}
+    errors = []
+    workers = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (4 * workers))
+    executor = ProcessPoolExecutor(max_workers=workers) if len(paths) > 1 and workers > 1 else None
+    bundles = executor.map(read_bundle, paths, chunksize=chunksize) if executor else map(read_bundle, paths)
+    for bundle in bundles:
+        if 'error' in bundle:
+            errors.append(f"{bundle['path']}: {bundle['error']}")
+            continue
+        previous = nodes.get(bundle['node'])
+        if previous is not None:
+            print(f"Warning: {bundle['node']} has two bundles ({previous['path']}, {bundle['path']}); "
+                  f"keeping the most recent one")
+            if previous.get('created', '') > bundle.get('created', ''):
+                continue
+        nodes[bundle['node']] = bundle
+    if executor is not None:
+        executor.shutdown()
+    return nodes, errors
+
+def load_reference(reference, nodes):
+    """Resolve --reference: a node name, a bundle file or an exported environment file.
+
+    Exported formats that record no channel (CHANNEL_LESS_FORMATS) return
+    (version, build) values; the node values are then reduced to match. Pip
+    packages of exported files are skipped, as bundles do not record them.
+    """
+    if reference in nodes:
+        return nodes[reference]['packages']
+    if not os.path.isfile(reference):
+        raise ValueError(f"'{reference}' is neither a node name nor a file")
+    if reference.endswith(('.tar.gz', '.tgz', '.tar.xz', '.tar.bz2', '.tar')):
+        bundle = read_bundle(reference)
+        if 'error' in bundle:
+            raise ValueError(bundle['error'])
+        return bundle['packages']
+    snapshot = load_export_file(reference)
+    with open(reference, encoding='utf-8') as f:
+        fields = 2 if detect_export_format(f.read()) in CHANNEL_LESS_FORMATS else 3
+    return {name: (info['version'], info['build'], info['channel'])[:fields]
+            for name, info in snapshot.packages.items() if info['channel'] != 'pypi'}
+
+def find_deviations(nodes, reference=None):
+    """Group the nodes by package value and find the ones deviating from the reference.
+
+    Without a reference, the expected value of each package is the one held
+    by most nodes, where "absent" counts as a value; ties go to the value
+    that sorts first. Returns {name: (expected, {value: [nodes]})}, with
+    None as the value of an absent package, for the packages with at least
+    one deviating node.
+    """
+    node_names = sorted(nodes)
+    holders = {}
+    for node in node_names:
+        for name, value in nodes[node]['packages'].items():
+            holders.setdefault(name, {}).setdefault(value, []).append(node)
+    if reference is not None:
+        for name in reference:
+            holders.setdefault(name, {})
+
+    deviations = {}
+    for name in sorted(holders):
+        groups = holders[name]
+        absent = len(node_names) - sum(len(group) for group in groups.values())
+        if absent:
+            present = {node for group in groups.values() for node in group}
+            groups[None] = [node for node in node_names if node not in present]
+        if reference is not None:
+            expected = reference.get(name)
+        else:
+            expected = min(groups, key=lambda value: (-len(groups[value]), value is None, value or ()))
+        deviating = {value: group for value, group in groups.items() if value != expected}
+        if deviating:
+            deviations[name] = (expected, deviating)
+    return deviations
+
+def format_value(value):
+    """Format a (version, build[, channel]) value as the conda_compare_envs_final.py --check output does."""
+    return 'absent' if value is None else f"{value[0]} ({', '.join(value[1:])})"
+
+def format_nodes(nodes):
+    shown = ', '.join(nodes[:MAX_LISTED_NODES])
+    return shown + (f' ... (+{len(nodes) - MAX_LISTED_NODES} more)' if len(nodes) > MAX_LISTED_NODES else '')
+
+def print_report(nodes, deviations, reference_name, top=10, reference=None):
+    """Print the per-package deviations and the nodes with the most deviating packages."""
+    per_node = {}
+    for name, (_, groups) in deviations.items():
+        for group in groups.values():
+            for node in group:
+                per_node[node] = per_node.get(node, 0) + 1
+    package_count = len({name for bundle in nodes.values() for name in bundle['packages']} | set(reference or ()))
+    print(f"\nReference: {reference_name}")
+    print(f"Packages deviating: {len(deviations)} of {package_count}; "
+          f"nodes deviating: {len(per_node)} of {len(nodes)}")
+
+    for name, (expected, groups) in deviations.items():
+        count = sum(len(group) for group in groups.values())
+        print(f"\n{name}: expected {format_value(expected)}, {count} node(s) deviating")
+        for value, group in sorted(groups.items(), key=lambda item: -len(item[1])):
+            print(f"    {format_value(value)}: {format_nodes(group)}")
+
+    if per_node:
+        print(f"\nNodes with the most deviating packages (top {top}):")
+        for node, count in sorted(per_node.items(), key=lambda item: (-item[1], item[0]))[:top]:
+            bundle = nodes[node]
+            print(f"    {node:<24} {count:>5} package(s)   last revision {bundle['last_revision_date']}")
+
+def write_csv(filename, deviations):
+    """Write one row per deviating (package, node) pair."""
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Package', 'Node', 'Expected', 'Actual'])
+        for name, (expected, groups) in deviations.items():
+            for value, group in groups.items():
+                for node in group:
+                    writer.writerow([name, node, format_value(expected), format_value(value)])
+
+def main():
+    """Main function to run the bundle collector and aggregator."""
+    parser = argparse.ArgumentParser(description="Collect conda-meta bundles and report fleet drift.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    collect = commands.add_parser('collect', help="pack an environment's conda-meta into a bundle")
+    collect.add_argument('env', help="name or prefix path of the environment")
+    collect.add_argument('--node', help="node name stored in the bundle (default: the host name)")
+    collect.add_argument('--output-dir', default='.', help="directory for the bundle (default: .)")
+    aggregate = commands.add_parser('aggregate', help="report the nodes deviating from a reference")
+    aggregate.add_argument('bundles', nargs='+', help="bundle files, directories of bundles or glob patterns")
+    aggregate.add_argument('--reference',
+                           help="node name, bundle or exported environment file (default: the majority)")
+    aggregate.add_argument('--jobs', type=int, default=None, help="worker processes (default: one per CPU)")
+    aggregate.add_argument('--top', type=int, default=10, help="number of most deviating nodes to show (default: 10)")
+    aggregate.add_argument('--csv', help="write every deviating (package, node) pair to this CSV file")
+    args = parser.parse_args()
+
+    if args.command == 'collect':
+        try:
+            filename, package_count = collect_bundle(args.env, args.node, args.output_dir)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: Could not collect {args.env}: {str(e)}")
+            sys.exit(EXIT_ERROR)
+        print(f"File: {filename} created ({package_count} packages).")
+        return
+
+    paths = find_bundles(args.bundles)
+    if not paths:
+        print("Error: no bundles found")
+        sys.exit(EXIT_ERROR)
+    print(f"Reading {len(paths)} bundles...")
+    nodes, errors = load_bundles(paths, args.jobs)
+    for error in errors:
+        print(f"Warning: Skipping bundle {error}")
+    if not nodes:
+        print("Error: no bundle could be read")
+        sys.exit(EXIT_ERROR)
+
+    reference = None
+    if args.reference:
+        try:
+            reference = load_reference(args.reference, nodes)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not load reference {args.reference}: {str(e)}")
+            sys.exit(EXIT_ERROR)
+    if reference and len(next(iter(reference.values()))) == 2:
+        for bundle in nodes.values():
+            bundle['packages'] = {name: value[:2] for name, value in bundle['packages'].items()}
+    deviations = find_deviations(nodes, reference)
+    print_report(nodes, deviations, args.reference or f"majority of {len(nodes)} nodes", args.top, reference)
+    if args.csv:
+        write_csv(args.csv, deviations)
+        print(f"\nFile: {args.csv} created.")
+    print("\nDone.")
+    if errors:
+        sys.exit(EXIT_ERROR)
+    sys.exit(EXIT_DIFFERENT if deviations else EXIT_IDENTICAL)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+File: conda_fleet_compare.py
+
+Fleet-wide similarity report for conda environments.
+
+Snapshots every environment listed by `conda env list` (or the environments
+given on the command line) and computes a pairwise Jaccard similarity matrix
+over the (name, version, build) records of their packages. Each environment
+is encoded once as a bitset of record ids, so every pair costs one AND and a
+popcount instead of a full diff; the matrix for a few hundred environments
+takes seconds.
+
+Optionally ranks the environments as "base candidates" for a requirements
+file, i.e. which existing environment is the closest starting point for a
+new project.
+
+Usage:
+    python conda_fleet_compare.py                        # every environment
+    python conda_fleet_compare.py env_a env_b env_c      # selected environments
+    python conda_fleet_compare.py --csv fleet_matrix.csv
+    python conda_fleet_compare.py --requirements requirements.txt --top 5
+
+Requirements are one spec per line: `name`, `name=version`, `name==version`,
+`name=version=build` or `name` followed by one of >=, <=, >, <, != or ~= and
+a version. A `=`/`==` version matches exactly or as a prefix on a dot
+boundary (`numpy=1.26` matches 1.26.4); the other operators compare versions
+the way the comparison report orders them (`~=2.31` means >=2.31 and 2.*).
+"""
+
+import re
+import sys
+import argparse
+import subprocess
+import pandas as pd
+
+from conda_compare_core import (
+    CACHE_DIR, CONDA_TIMEOUT, MAX_WORKERS, ProbeError, SnapshotCache,
+    collect_snapshots, compare_version_keys, list_conda_envs, version_key,
+)
+
+REQUIREMENT_PATTERN = re.compile(r'^([A-Za-z0-9_.\-]+)\s*(==|=|>=|<=|~=|!=|>|<)?\s*(\S+)?$')
+
+def popcount(value):
+    """Count the set bits of a non-negative integer."""
+    return value.bit_count() if hasattr(value, 'bit_count') else bin(value).count('1')
+
+def build_bitsets(snapshots):
+    """Encode each snapshot as a bitset over the distinct (name, version, build) records."""
+    record_ids = {}
+    env_ids = []
+    for snapshot in snapshots:
+        env_ids.append([
+            record_ids.setdefault((pkg, info['version'], info['build']), len(record_ids))
+            for pkg, info in snapshot.packages.items()
+        ])
+
+    bitsets = []
+    for ids in env_ids:
+        bits = bytearray((len(record_ids) + 7) // 8)
+        for record_id in ids:
+            bits[record_id >> 3] |= 1 << (record_id & 7)
+        bitsets.append(int.from_bytes(bits, 'little'))
+    return bitsets
+
+def similarity_matrix(snapshots):
+    """Return the pairwise Jaccard similarity of all snapshots as a DataFrame."""
+    bitsets = build_bitsets(snapshots)
+    counts = [popcount(bits) for bits in bitsets]
+    n = len(snapshots)
+    matrix = [[1.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            shared = popcount(bitsets[i] & bitsets[j])
+            union = counts[i] + counts[j] - shared
+            matrix[i][j] = matrix[j][i] = shared / union if union else 1.0
+    names = [snapshot.name for snapshot in snapshots]
+    return pd.DataFrame(matrix, index=names, columns=names)
+
+def closest_pairs(matrix, top=10):
+    """Return the most similar distinct environment pairs, best first."""
+    names = list(matrix.index)
+    pairs = [
+        (names[i], names[j], matrix.iat[i, j])
+        for i in range(len(names))
+        for j in range(i + 1, len(names))
+    ]
+    pairs.sort(key=lambda pair: pair[2], reverse=True)
+    return pd.DataFrame(pairs[:top], columns=['Environment', 'Closest_To', 'Similarity'])
+
+def read_requirements(filename):
+    """Parse a requirements file into (name, operator, version, build) specs.
+
+    Raises ValueError naming the line for specs that cannot be evaluated
+    (e.g. several constraints, extras or a range operator with a build).
+    """
+    specs = []
+    with open(filename) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            match = REQUIREMENT_PATTERN.match(line)
+            operator, rest = (match.group(2), match.group(3)) if match else (None, None)
+            if not match or (operator is None) != (rest is None):
+                raise ValueError(f"{filename}:{line_number}: unsupported requirement '{line}'")
+            name = match.group(1).lower()
+            if operator in (None, '=', '=='):
+                version, _, build = (rest or '').partition('=')
+                specs.append((name, '=', version or None, build or None))
+                continue
+            if ',' in rest or '=' in rest or version_key(rest) is None or (operator == '~=' and '.' not in rest):
+                raise ValueError(f"{filename}:{line_number}: unsupported requirement '{line}'")
+            specs.append((name, operator, rest, None))
+    return specs
+
+def spec_matches(info, operator, version, build):
+    """Check one installed package record against a requirement's operator, version and build."""
+    if operator != '=':
+        installed = version_key(info['version'])
+        if installed is None:
+            return False
+        order = compare_version_keys(installed, version_key(version))
+        if operator == '~=':
+            return order >= 0 and info['version'].startswith(version.rsplit('.', 1)[0] + '.')
+        return {'>=': order >= 0, '<=': order <= 0, '>': order > 0, '<': order < 0, '!=': order != 0}[operator]
+    if version and info['version'] != version and not info['version'].startswith(version + '.'):
+        return False
+    return not build or info['build'] == build
+
+def rank_base_candidates(snapshots, specs, top=10):
+    """Rank environments by how many requirements they already satisfy.
+
+    Ties are broken by the number of packages that are not required, so the
+    leanest environment that covers the requirements comes first.
+    """
+    rows = []
+    for snapshot in snapshots:
+        satisfied = [
+            name for name, operator, version, build in specs
+            if name in snapshot.packages and spec_matches(snapshot.packages[name], operator, version, build)
+        ]
+        missing = [name for name, _, _, _ in specs if name not in satisfied]
+        rows.append({
+            'Environment': snapshot.name,
+            'Satisfied': len(satisfied),
+            'Required': len(specs),
+            'Extra_Packages': snapshot.package_count - len(satisfied),
+            'Missing': ', '.join(missing[:8]) + (' ...' if len(missing) > 8 else ''),
+        })
+    ranking = pd.DataFrame(rows, columns=['Environment', 'Satisfied', 'Required', 'Extra_Packages', 'Missing'])
+    ranking = ranking.sort_values(['Satisfied', 'Extra_Packages'], ascending=[False, True])
+    return ranking.head(top)
+
+def main():
+    """Main function to run the fleet comparison."""
+    parser = argparse.ArgumentParser(description="Pairwise similarity of conda environments.")
+    parser.add_argument('envs', nargs='*', metavar='env',
+                        help="environments to compare (default: every environment from conda env list)")
+    parser.add_argument('--requirements', help="rank environments as base candidates for this requirements file")
+    parser.add_argument('--top', type=int, default=10, help="number of pairs / candidates to show (default: 10)")
+    parser.add_argument('--matrix', action='store_true', help="print the full similarity matrix")
+    parser.add_argument('--csv', help="write the full similarity matrix to this CSV file")
+    parser.add_argument('--jobs', type=int, default=MAX_WORKERS,
+                        help=f"maximum number of concurrent probes (default: {MAX_WORKERS})")
+    parser.add_argument('--timeout', type=float, default=CONDA_TIMEOUT,
+                        help=f"timeout in seconds for each conda command (default: {CONDA_TIMEOUT})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f"do not read the snapshot cache in {CACHE_DIR}")
+    parser.add_argument('--refresh', action='store_true', help="ignore cached snapshots")
+    args = parser.parse_args()
+
+    specs = None
+    if args.requirements:
+        try:
+            specs = read_requirements(args.requirements)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not read requirements: {str(e)}")
+            sys.exit(1)
+
+    try:
+        env_names = args.envs or list_conda_envs(timeout=args.timeout)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError, ValueError, ProbeError) as e:
+        print(f"Error: Could not list the conda environments: {str(e)}")
+        sys.exit(1)
+    print(f"Snapshotting {len(env_names)} environments...")
+    try:
+        snapshots = collect_snapshots(env_names, max_workers=args.jobs, timeout=args.timeout,
+                                      cache=None if args.no_cache else SnapshotCache(),
+                                      refresh=args.refresh, with_revisions=False)
+    except ProbeError as e:
+        print(f"Error: Could not collect environment data:\n{str(e)}")
+        sys.exit(1)
+    snapshots = list(snapshots.values())
+
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', None)
+
+    matrix = similarity_matrix(snapshots)
+    if args.matrix:
+        print("\nJaccard similarity (name + version + build):")
+        print(matrix.round(3).to_string())
+    if len(snapshots) > 1:
+        print(f"\nMost similar environment pairs (top {args.top}):")
+        print(closest_pairs(matrix, top=args.top).to_string(index=False, float_format='{:.3f}'.format))
+
+    if specs is not None:
+        print(f"\nBase candidates for {args.requirements} ({len(specs)} requirements):")
+        print(rank_base_candidates(snapshots, specs, top=args.top).to_string(index=False))
+
+    if args.csv:
+        matrix.to_csv(args.csv, float_format='%.4f')
+        print(f"\nFile: {args.csv} created.")
+    print("\nDone.")
+
+if __name__ == "__main__":
+    main()
@@ -4,26 +4,56 @@ Deep Compare Two Conda Environments
 Compares two user-named Conda environments to identify differences in their installed packages, revision histories, and installation commands.
 The comparison report is saved as a timestamped text file named "conda_diffs_{env1}_{env2}_{datetime}.txt" in the specified output folder.
 
+The three probes of each environment (`conda list --export`, `conda list --revisions` and `conda env export`)
+run concurrently, and their outputs are parsed into structured records, so the report shows keyed
+differences (package name -> version/build, revision number -> changes, dependency name -> spec)
+instead of raw text dumps.
+
 Dependencies:
 - conda
+- conda_compare_core.py from the repository root (the export parsers)
 
 Ensure conda is installed and accessible in your system's PATH.
 
 Usage:
 1. Open a terminal or command prompt.
 2. Run the script with the two environment names as arguments:
-   python conda_diffs_2envs_3ways.py PDF_AI_tools PDF_AI_Tools
-3. The comparison report will be saved in "C:/Users/PowerUser/Desktop/Windows_System_Reports" with a timestamped filename.
+   python conda_diffs_2envs_3ways.py PDF_AI_tools PDF_AI_Tools [output_folder]
+3. The comparison report will be saved in "C:/Users/PowerUser/Desktop/Windows_System_Reports" (or output_folder) with a timestamped filename.
 4. Check the "compare_conda_envs.log" file in the output folder for detailed logs of the operations performed.
+5. The exit status is 0 if the packages and dependencies are identical, 1 if they differ and 2 if a
+   probe failed, so the script can gate pre-merge checks. Revision history differences are reported
+   but do not affect the exit status.
 
 Generated by Rich Lysakowski
 """
 
 import os
+import re
 import subprocess
 import datetime
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# The export parsers are shared with the main comparison tool in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conda_compare_core import parse_conda_export, parse_environment_yml  # noqa: E402
+
+CONDA_TIMEOUT = 120  # seconds per conda command
+PROBES = {
+    "packages": ["list", "--export"],
+    "revision_history": ["list", "--revisions"],
+    "install_commands": ["env", "export"],
+}
+EXIT_IDENTICAL = 0
+EXIT_DIFFERENT = 1
+EXIT_ERROR = 2
+
+# "2024-12-28 18:04:00  (rev 3)" starts a revision in `conda list --revisions` output
+REVISION_HEADER = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\s+\(rev (\d+)\)\s*$")
+# " numpy  {1.26.3 (defaults/linux-64) -> 1.26.4 (defaults/linux-64)}"
+REVISION_UPDATE = re.compile(r"^\s+(\S+)\s+\{(.*) -> (.*)\}\s*$")
 
 def setup_logging(output_folder: str) -> None:
     """
@@ -43,93 +73,250 @@ def setup_logging(output_folder: str) -> None:
     )
     # Generated by Rich Lysakowski
 
-def get_conda_info(env_name: str) -> dict:
+def run_probe(env_name: str, probe: str) -> str:
     """
-    Retrieves Conda environment information including packages and revision history.
+    Runs one conda probe for an environment.
 
     Args:
         env_name (str): The name of the Conda environment.
+        probe (str): A key of PROBES.
 
     Returns:
-        dict: A dictionary containing packages and revision history.
+        str: The command output, or None if the command failed.
     """
+    command = ["conda"] + PROBES[probe] + ["--name", env_name]
     try:
-        # Get list of installed packages
-        package_list = subprocess.check_output(
-            ["conda", "list", "--name", env_name, "--export"],
-            stderr=subprocess.STDOUT
-        ).decode("utf-8").strip().split('\n')
-
-        # Get revision history
-        revision_history = subprocess.check_output(
-            ["conda", "history", "--name", env_name],
-            stderr=subprocess.STDOUT
-        ).decode("utf-8").strip()
-
-        return {
-            "packages": set(package_list),
-            "revision_history": revision_history
-        }
+        # stderr is kept apart: conda's warnings (e.g. "A newer version of conda exists") would
+        # otherwise be parsed as records
+        return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              timeout=CONDA_TIMEOUT, check=True).stdout.decode("utf-8")
     except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to retrieve information for environment \"{env_name}\". Error: {e.output.decode('utf-8')}")
-        return {
-            "packages": set(),
-            "revision_history": "Unavailable"
-        }
-    # Generated by Rich Lysakowski
+        logging.error(f"Failed to run \"{' '.join(command)}\". Error: {e.stderr.decode('utf-8').strip()}")
+    except subprocess.TimeoutExpired:
+        logging.error(f"\"{' '.join(command)}\" timed out after {CONDA_TIMEOUT} seconds.")
+    except OSError as e:
+        logging.error(f"Could not run conda. Error: {e}")
+    return None
+
+def parse_dist(dist: str) -> tuple:
+    """
+    Splits a "+name-version (channel)" entry of `conda list --revisions` output.
+
+    The entries carry no build string, so only the last "-" separates the name from the version
+    (names such as "anaconda-anon-usage" contain dashes themselves).
 
-def compare_packages(env1_packages: set, env2_packages: set) -> dict:
+    Args:
+        dist (str): The entry with its leading "+" or "-".
+
+    Returns:
+        tuple: (name, "+version (channel)") or (name, "-version (channel)").
     """
-    Compares the packages of two Conda environments.
+    sign, spec = dist[0], dist[1:].strip()
+    spec, _, channel = spec.partition(" ")
+    name, _, version = spec.rpartition("-")
+    if not name:
+        name, version = version, ""
+    return name, f"{sign}{version} {channel}".strip()
+
+def parse_history(text: str) -> dict:
+    """
+    Parses `conda list --revisions` output into revision records.
+
+    Args:
+        text (str): The output of `conda list --revisions`.
+
+    Returns:
+        dict: {revision number: {"date": str, "changes": {name: change}}}, where a change is
+        "+version (channel)" (installed), "-version (channel)" (removed) or "old -> new" (updated).
+    """
+    revisions = {}
+    changes = None
+    for line in text.splitlines():
+        header = REVISION_HEADER.match(line)
+        if header:
+            changes = {}
+            revisions[int(header.group(2))] = {"date": header.group(1), "changes": changes}
+            continue
+        if changes is None or not line.strip() or line.lstrip().startswith("#"):
+            continue  # text before the first revision, blank lines and "# cmd:" lines
+        update = REVISION_UPDATE.match(line)
+        if update:
+            changes[update.group(1)] = f"{update.group(2).strip()} -> {update.group(3).strip()}"
+        elif line.strip()[0] in "+-":
+            name, detail = parse_dist(line.strip())
+            previous = changes.get(name)
+            if previous and previous[0] in "+-" and previous[0] != detail[0]:
+                # a "-old" and "+new" pair of the same package within one revision
+                removed, installed = (previous, detail) if previous[0] == "-" else (detail, previous)
+                detail = f"{removed[1:]} -> {installed[1:]}"
+            changes[name] = detail
+    return revisions
+
+def parse_env_export(text: str) -> dict:
+    """
+    Parses `conda env export` YAML into channels and keyed conda and pip dependencies.
 
     Args:
-        env1_packages (set): Packages from the first environment.
-        env2_packages (set): Packages from the second environment.
+        text (str): The output of `conda env export`.
 
     Returns:
-        dict: A dictionary containing added and removed packages.
+        dict: {"channels": [str], "conda": {name: record}, "pip": {name: record}}, with records as
+        returned by conda_compare_core.parse_environment_yml.
     """
-    added = env2_packages - env1_packages
-    removed = env1_packages - env2_packages
+    channels = []
+    packages = parse_environment_yml(text, channels)
     return {
-        "added": added,
-        "removed": removed
+        "channels": channels,
+        "conda": {name: record for name, record in packages.items() if record["channel"] != "pypi"},
+        "pip": {name: record for name, record in packages.items() if record["channel"] == "pypi"},
     }
-    # Generated by Rich Lysakowski
 
-def generate_install_commands(env_name: str) -> str:
+def get_conda_info(env_names: list) -> dict:
     """
-    Generates the installation commands used to build a Conda environment.
+    Runs every probe for every environment concurrently and parses the outputs.
 
     Args:
-        env_name (str): The name of the Conda environment.
+        env_names (list): The names of the Conda environments.
 
     Returns:
-        str: The installation commands as a string.
+        dict: {env_name: {probe: parsed record, or None if the probe failed}}.
     """
-    try:
-        env_export = subprocess.check_output(
-            ["conda", "env", "export", "--name", env_name],
-            stderr=subprocess.STDOUT
-        ).decode("utf-8")
-        return env_export
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to export environment \"{env_name}\". Error: {e.output.decode('utf-8')}")
-        return "Unavailable"
+    parsers = {
+        "packages": parse_conda_export,
+        "revision_history": parse_history,
+        "install_commands": parse_env_export,
+    }
+    jobs = [(env_name, probe) for env_name in env_names for probe in PROBES]
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        outputs = list(executor.map(lambda job: run_probe(*job), jobs))
+    info = {env_name: {} for env_name in env_names}
+    for (env_name, probe), output in zip(jobs, outputs):
+        info[env_name][probe] = parsers[probe](output) if output is not None else None
+    return info
+
+def compare_keyed(records1: dict, records2: dict) -> dict:
+    """
+    Compares two keyed records.
+
+    Args:
+        records1 (dict): Records of the first environment.
+        records2 (dict): Records of the second environment.
+
+    Returns:
+        dict: "added" (keys only in records2), "removed" (keys only in records1) and
+        "changed" ({key: (value1, value2)} for keys whose values differ).
+    """
+    return {
+        "added": {key: records2[key] for key in sorted(records2.keys() - records1.keys())},
+        "removed": {key: records1[key] for key in sorted(records1.keys() - records2.keys())},
+        "changed": {key: (records1[key], records2[key]) for key in sorted(records1.keys() & records2.keys())
+                    if records1[key] != records2[key]},
+    }
+
+def compare_packages(env1_packages: dict, env2_packages: dict) -> dict:
+    """
+    Compares the packages of two Conda environments.
+
+    Args:
+        env1_packages (dict): {name: record} from the first environment (parse_conda_export).
+        env2_packages (dict): {name: record} from the second environment (parse_conda_export).
+
+    Returns:
+        dict: A dictionary containing added, removed and changed packages.
+    """
+    return compare_keyed(env1_packages, env2_packages)
     # Generated by Rich Lysakowski
 
+def compare_histories(env1_history: dict, env2_history: dict) -> dict:
+    """
+    Compares two revision histories revision by revision.
+
+    Args:
+        env1_history (dict): Parsed `conda list --revisions` of the first environment.
+        env2_history (dict): Parsed `conda list --revisions` of the second environment.
+
+    Returns:
+        dict: "added"/"removed" revision numbers and, for revisions in both, "changed":
+        {rev: {"date": (date1, date2) or None, "changes": compare_keyed() of the package changes}}.
+    """
+    diff = compare_keyed(env1_history, env2_history)
+    changed = {}
+    for rev, (rev1, rev2) in diff["changed"].items():
+        dates = (rev1["date"], rev2["date"]) if rev1["date"] != rev2["date"] else None
+        changed[rev] = {"date": dates, "changes": compare_keyed(rev1["changes"], rev2["changes"])}
+    diff["changed"] = changed
+    return diff
+
+def compare_install_commands(env1_export: dict, env2_export: dict) -> dict:
+    """
+    Compares two parsed `conda env export` files.
+
+    Args:
+        env1_export (dict): Parsed export of the first environment.
+        env2_export (dict): Parsed export of the second environment.
+
+    Returns:
+        dict: "channels" ((channels1, channels2) if the channel lists differ, else None),
+        "conda" and "pip" (compare_keyed() of the dependencies).
+    """
+    channels = (env1_export["channels"], env2_export["channels"])
+    return {
+        "channels": channels if channels[0] != channels[1] else None,
+        "conda": compare_keyed(env1_export["conda"], env2_export["conda"]),
+        "pip": compare_keyed(env1_export["pip"], env2_export["pip"]),
+    }
+
+def format_value(value) -> str:
+    """Formats a package record ("version=build", plus the channel if known) or a change for the report."""
+    if not isinstance(value, dict):
+        return str(value)
+    text = "=".join(part for part in (value["version"], value["build"]) if part)
+    return f"{text} ({value['channel']})" if value["channel"] else text
+
+def write_keyed_diff(report_file, diff: dict, env1: str, env2: str, indent: str = "") -> int:
+    """
+    Writes a compare_keyed() result and returns the number of differences written.
+
+    Args:
+        report_file: The open report file.
+        diff (dict): The keyed comparison.
+        env1 (str): Name of the first environment.
+        env2 (str): Name of the second environment.
+        indent (str): Prefix of every line.
+    """
+    for key, value in diff["added"].items():
+        report_file.write(f"{indent}+ {key}: {format_value(value)} (only in {env2})\n")
+    for key, value in diff["removed"].items():
+        report_file.write(f"{indent}- {key}: {format_value(value)} (only in {env1})\n")
+    for key, (value1, value2) in diff["changed"].items():
+        report_file.write(f"{indent}~ {key}: {format_value(value1)} -> {format_value(value2)}\n")
+    return len(diff["added"]) + len(diff["removed"]) + len(diff["changed"])
+
+def write_history_diff(report_file, diff: dict, env1: str, env2: str) -> int:
+    """Writes a compare_histories() result and returns the number of differing revisions."""
+    for rev in diff["added"]:
+        report_file.write(f"+ rev {rev} ({diff['added'][rev]['date']}): only in {env2}\n")
+    for rev in diff["removed"]:
+        report_file.write(f"- rev {rev} ({diff['removed'][rev]['date']}): only in {env1}\n")
+    for rev, change in diff["changed"].items():
+        report_file.write(f"~ rev {rev}:\n")
+        if change["date"]:
+            report_file.write(f"    date: {change['date'][0]} -> {change['date'][1]}\n")
+        write_keyed_diff(report_file, change["changes"], env1, env2, indent="    ")
+    return len(diff["added"]) + len(diff["removed"]) + len(diff["changed"])
+
 def main():
     """
     Main function to compare two Conda environments and generate a report.
     """
-    if len(sys.argv) != 3:
-        print("Usage: python conda_diffs_2envs_3ways.py env1 env2")
-        sys.exit(1)
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python conda_diffs_2envs_3ways.py env1 env2 [output_folder]")
+        sys.exit(EXIT_ERROR)
 
     env1 = sys.argv[1]
     env2 = sys.argv[2]
 
-    output_folder = "C:/Users/PowerUser/Desktop/Windows_System_Reports"
+    output_folder = sys.argv[3] if len(sys.argv) == 4 else "C:/Users/PowerUser/Desktop/Windows_System_Reports"
     os.makedirs(output_folder, exist_ok=True)
 
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -139,47 +326,60 @@ def main():
     setup_logging(output_folder)
     logging.info(f"Starting comparison between \"{env1}\" and \"{env2}\".")
 
-    env1_info = get_conda_info(env1)
-    env2_info = get_conda_info(env2)
-
-    package_comparison = compare_packages(env1_info["packages"], env2_info["packages"])
-
-    env1_install = generate_install_commands(env1)
-    env2_install = generate_install_commands(env2)
-
+    info = get_conda_info([env1, env2])
+    env1_info, env2_info = info[env1], info[env2]
+    # the revision histories record dates and order, so they differ between any two environments
+    # and are reported for information only; the exit status follows the other two sections
+    sections = [
+        ("Package Differences", "packages", compare_packages, write_keyed_diff, True),
+        ("Revision Histories", "revision_history", compare_histories, write_history_diff, False),
+        ("Installation Commands", "install_commands", compare_install_commands, None, True),
+    ]
+
+    differences = 0
+    failed = False
     try:
         with open(report_path, "w", encoding="utf-8") as report_file:
             report_file.write("Conda Environment Comparison Report\n")
             report_file.write(f"Environments: \"{env1}\" vs \"{env2}\"\n")
-            report_file.write(f"Generated on: {datetime.datetime.now()}\n\n")
-
-            report_file.write("=== Package Differences ===\n")
-            report_file.write(f"**Packages Added in {env2}:**\n")
-            for pkg in sorted(package_comparison["added"]):
-                report_file.write(f"- {pkg}\n")
-            report_file.write(f"\n**Packages Removed from {env1}:**\n")
-            for pkg in sorted(package_comparison["removed"]):
-                report_file.write(f"- {pkg}\n")
-
-            report_file.write("\n=== Revision Histories ===\n")
-            report_file.write(f"**{env1} Revision History:**\n")
-            report_file.write(env1_info["revision_history"] + "\n\n")
-            report_file.write(f"**{env2} Revision History:**\n")
-            report_file.write(env2_info["revision_history"] + "\n\n")
-
-            report_file.write("=== Installation Commands ===\n")
-            report_file.write(f"**{env1} Installation Commands:**\n")
-            report_file.write(env1_install + "\n\n")
-            report_file.write(f"**{env2} Installation Commands:**\n")
-            report_file.write(env2_install + "\n\n")
+            report_file.write(f"Generated on: {datetime.datetime.now()}\n")
+            report_file.write(f"Legend: + only in {env2}, - only in {env1}, ~ changed ({env1} -> {env2})\n\n")
+
+            for title, probe, compare, write, gates in sections:
+                report_file.write(f"=== {title} ===\n")
+                if env1_info[probe] is None or env2_info[probe] is None:
+                    report_file.write("Unavailable (see the log for the conda error)\n\n")
+                    failed = True
+                    continue
+                diff = compare(env1_info[probe], env2_info[probe])
+                if write is not None:
+                    count = write(report_file, diff, env1, env2)
+                else:
+                    count = 0
+                    if diff["channels"]:
+                        report_file.write(f"~ channels: {', '.join(diff['channels'][0])} -> "
+                                          f"{', '.join(diff['channels'][1])}\n")
+                        count += 1
+                    for kind in ("conda", "pip"):
+                        report_file.write(f"**{kind} dependencies:**\n")
+                        count += write_keyed_diff(report_file, diff[kind], env1, env2, indent="  ")
+                if not count:
+                    report_file.write("No differences.\n")
+                report_file.write("\n")
+                if gates:
+                    differences += count
 
         logging.info(f"Comparison report generated at \"{report_path}\".")
     except Exception as e:
         logging.error(f"Failed to write the comparison report. Error: {e}")
+        failed = True
 
     print(f"Comparison report available at \"{report_path}\"")
+    if failed:
+        sys.exit(EXIT_ERROR)
+    sys.exit(EXIT_DIFFERENT if differences else EXIT_IDENTICAL)
     # Generated by Rich Lysakowski
 
 if __name__ == "__main__":
     main()
-    # Generated by Rich Lysakowski
\ No newline at end of file
+    # Generated by Rich Lysakowski